@@ -1,7 +1,7 @@
 from django.contrib import admin, messages
 
-from .backend import SugarCRMBackendError
-from .models import SugarCRMServiceProjectLink, SugarCRMService, CRM
+from .engine import BatchEngine
+from .models import SugarCRMServiceProjectLink, SugarCRMService, CRM, QuotasSync, QuotasSyncResult
 from nodeconductor.quotas.admin import QuotaInline
 from nodeconductor.structure import admin as structure_admin
 
@@ -11,18 +11,19 @@ class CRMAdmin(structure_admin.PublishableResourceAdmin):
     inlines = [QuotaInline]
 
     def sync_quotas(self, request, queryset):
-        successfully_synced = []
+        online_crms = []
         for crm in queryset:
             if crm.state != CRM.States.ONLINE:
                 message = 'Cannot sync quotas for CRM "%s" it is not ONLINE' % crm.name
                 self.message_user(request, message, level=messages.WARNING)
                 continue
+            online_crms.append(crm)
 
-            backend = crm.get_backend()
-            try:
-                backend.sync_user_quota()
-            except SugarCRMBackendError as e:
-                message = 'Cannot sync user quota for CRM "%s". Error: %s' % (crm.name, e)
+        # quotas of all selected CRMs are synced concurrently
+        successfully_synced = []
+        for crm, outcome in BatchEngine().sync_crms_user_quotas(online_crms).items():
+            if outcome.error is not None:
+                message = 'Cannot sync user quota for CRM "%s". Error: %s' % (crm.name, outcome.error)
                 self.message_user(request, message, level=messages.ERROR)
                 continue
 
@@ -40,6 +41,20 @@ class SugarCRMServiceProjectLinkAdmin(structure_admin.ServiceProjectLinkAdmin):
     inlines = [QuotaInline]
 
 
+class QuotasSyncResultInline(admin.TabularInline):
+    model = QuotasSyncResult
+    fields = readonly_fields = ('crm', 'user_count', 'latency', 'error_message')
+    extra = 0
+    can_delete = False
+
+
+class QuotasSyncAdmin(admin.ModelAdmin):
+    list_display = ('created', 'finished', 'crms_count', 'succeeded_count', 'failed_count')
+    readonly_fields = list_display
+    inlines = [QuotasSyncResultInline]
+
+
 admin.site.register(CRM, CRMAdmin)
 admin.site.register(SugarCRMService, structure_admin.ServiceAdmin)
 admin.site.register(SugarCRMServiceProjectLink, SugarCRMServiceProjectLinkAdmin)
+admin.site.register(QuotasSync, QuotasSyncAdmin)
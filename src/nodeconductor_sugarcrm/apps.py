@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models import signals
 
 
 class SugarCRMConfig(AppConfig):
@@ -31,6 +32,12 @@ class SugarCRMConfig(AppConfig):
             dispatch_uid='nodeconductor_sugarcrm.handlers.log_user_post_delete'
         )
 
+        signals.post_save.connect(
+            handlers.invalidate_service_settings_options,
+            sender=ServiceSettings,
+            dispatch_uid='nodeconductor_sugarcrm.handlers.invalidate_service_settings_options',
+        )
+
         ServiceSettings.add_quota_field(
             name='sugarcrm_user_count',
             quota_field=LimitAggregatorQuotaField(
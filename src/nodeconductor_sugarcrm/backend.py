@@ -1,19 +1,33 @@
+import collections
+import json
 import logging
 import md5
+import operator
+import threading
 import urlparse
+from multiprocessing.pool import ThreadPool
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import Resolver404
-from django.utils import six
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import six, timezone
 import requests
+from requests.adapters import HTTPAdapter
 from rest_framework.reverse import reverse
 import sugarcrm
 
 from nodeconductor.core.tasks import send_task
 from nodeconductor.core.utils import pwgen
+from nodeconductor.monitoring import models as monitoring_models
 from nodeconductor.structure import ServiceBackend, ServiceBackendError
 
-from . import models
+from . import metrics, models
+from .cache import credentials_cache, single_flight
+from .circuit_breaker import CircuitOpenError, circuit_breaker, get_timeouts
+from .utils import get_options, get_plugin_setting
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +37,148 @@ class SugarCRMBackendError(ServiceBackendError):
     pass
 
 
+class SugarCRMUnavailableError(SugarCRMBackendError):
+    """ Request to CRM was not executed because circuit of its host is open """
+
+
+def get_request_error(error, message):
+    """ Get backend error for error of request to CRM """
+    if isinstance(error, CircuitOpenError):
+        return SugarCRMUnavailableError(message)
+    return SugarCRMBackendError(message)
+
+
+class SugarCRMQueryError(sugarcrm.SugarError):
+    """ SugarCRM responded with error to query, request itself succeeded """
+
+
+_http_sessions = collections.OrderedDict()
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(key, pool_maxsize=None, **attributes):
+    """ Get process-wide HTTP session for given key.
+
+    Sessions keep connections alive, so consequent requests to the same host do not open new connections.
+    At most NODECONDUCTOR_SUGARCRM['HTTP_SESSIONS_LIMIT'] sessions are kept (default: 100), the least recently
+    used session is closed when limit is exceeded. If <pool_maxsize> is defined - session keeps no more
+    than given number of connections.
+    """
+    with _http_sessions_lock:
+        session = _http_sessions.pop(key, None)
+        if session is None:
+            session = requests.Session()
+            if pool_maxsize is not None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+            for name, value in attributes.items():
+                setattr(session, name, value)
+        _http_sessions[key] = session
+        stale_sessions = []
+        while len(_http_sessions) > get_plugin_setting('HTTP_SESSIONS_LIMIT', 100):
+            stale_sessions.append(_http_sessions.popitem(last=False)[1])
+    for stale_session in stale_sessions:
+        # connections that are in use are closed when they are released
+        stale_session.close()
+    return session
+
+
+class SugarCRMSession(sugarcrm.Session):
+    """ SugarCRM v4 API session that reuses cached session id and keeps connections alive.
+
+    If SugarCRM reports that session id is invalid - session logs in again and repeats request.
+    """
+    INVALID_SESSION_ERROR_NUMBER = 11
+
+    def __init__(self, url, username, password, app='Python', lang='en_us', crm_uuid=''):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.crm_uuid = crm_uuid
+        self.application = app
+        self.language = lang
+        self.http_session = get_http_session(
+            ('sugarcrm', url), pool_maxsize=get_plugin_setting('CRM_CONNECTIONS_LIMIT', 4))
+        self.session_id = credentials_cache.get(credentials_cache.Types.V4_SESSION, url, username)
+        if self.session_id is None:
+            self.relogin()
+
+    def relogin(self):
+        credentials_cache.invalidate(credentials_cache.Types.V4_SESSION, self.url, self.username)
+        metrics.record_reauthentication('sugarcrm-v4 login', self.crm_uuid)
+        result = self.login(self.username, self.password, app=self.application, lang=self.language)
+        if 'id' not in result:
+            raise sugarcrm.SugarError('Cannot login to SugarCRM as %s: %s' % (self.username, result))
+        self.session_id = result['id']
+        lifetime = get_plugin_setting('V4_SESSION_LIFETIME', 20 * 60)
+        credentials_cache.set(credentials_cache.Types.V4_SESSION, self.url, self.username, self.session_id, lifetime)
+
+    def _request(self, method, params, retry_if_session_is_invalid=True):
+        data = {
+            'method': method,
+            'input_type': 'JSON',
+            'response_type': 'JSON',
+            'rest_data': json.dumps(params)
+        }
+        endpoint = 'sugarcrm-v4 %s' % method
+        response = circuit_breaker.call(self.url, lambda: metrics.measure_request(
+            endpoint, self.crm_uuid, lambda: self.http_session.post(self.url, data=data, timeout=get_timeouts())))
+        if response.status_code != 200:
+            raise sugarcrm.SugarError('SugarCRM API _request returned status code %d (%s)' % (
+                response.status_code, response.reason))
+        result = json.loads(response.text.replace('&#039;', "'"))
+
+        if (isinstance(result, dict) and result.get('number') == self.INVALID_SESSION_ERROR_NUMBER and
+                method != 'login' and retry_if_session_is_invalid):
+            metrics.record_retry(endpoint, self.crm_uuid)
+            self.relogin()
+            params = [self.session_id] + list(params[1:])
+            return self._request(method, params, retry_if_session_is_invalid=False)
+        return result
+
+
+class SugarCRMUsersList(object):
+    """ Lazy list of CRM users that are stored in SugarCRM.
+
+    List supports count() and slicing, so it can be paginated as queryset.
+    Each slice is fetched from SugarCRM with one request.
+    """
+
+    def __init__(self, backend, fields=(), **filters):
+        self.backend = backend
+        self.fields = tuple(fields)
+        self.filters = filters
+
+    def count(self):
+        try:
+            return self.backend.coalesce(
+                'count_visible_users', self.filters,
+                lambda: self.backend.sugar_client.count_visible_users(**self.filters))
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot count users on CRM "%s". Error: %s' % (self.backend.crm.name, e))
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('Users list supports only slicing without step.')
+        offset = key.start or 0
+        if key.stop is None:
+            raise TypeError('Users list slice should be limited.')
+        if key.stop <= offset:
+            return []
+        limit = key.stop - offset
+        try:
+            return self.backend.coalesce(
+                'list_visible_users_page', (offset, limit, self.fields, self.filters),
+                lambda: self.backend.sugar_client.list_visible_users_page(
+                    offset, limit, fields=self.fields, **self.filters))
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot get users from CRM "%s". Error: %s' % (self.backend.crm.name, e))
+
+
 class SugarCRMBaseBackend(ServiceBackend):
 
     def __init__(self, settings, crm=None):
@@ -59,26 +215,42 @@ class SugarCRMBackend(SugarCRMBaseBackend):
     DEFAULTS = {
         'user_data': "#cloud-config:\nruncmd:\n  - [ bootstrap, -p, {password}, -k, {license_code}, -v]",
         'protocol': "http",
+        'users_page_size': 100,
+        'users_fetch_parallelism': 4,
+        'quotas_sync_concurrency': 5,
     }
 
     CRM_ADMIN_NAME = 'admin'
+    # maximal page size of NC lists
+    INSTANCES_LIST_PAGE_SIZE = 300
+    USER_COPIES_BATCH_SIZE = 500
+    ROWS_UPDATE_BATCH_SIZE = 500
 
     class NodeConductorOpenStackClient(object):
+        """ Client for NC OpenStack application endpoints.
 
-        def __init__(self, template_url, username, password):
+        HTTP sessions are shared between all clients of the process, so connections to NC are kept alive
+        and authentication token is reused by backend instances. Token is refreshed only if NC responds with 401.
+        """
+        def __init__(self, template_url, username, password, crm_uuid=''):
             self.credentials = {
                 'username': username,
                 'password': password,
             }
+            self.crm_uuid = crm_uuid
             parsed = urlparse.urlparse(template_url)
             self.scheme = parsed.scheme
             self.netloc = parsed.netloc
+            self.session = get_http_session((self.scheme, self.netloc, username), verify=False)
 
         def authenticate(self):
             url = self._prepare_url(reverse('auth-password'))
-            response = requests.post(url, data=self.credentials, verify=False)
+            endpoint = metrics.get_endpoint_name('nodeconductor', 'post', url)
+            metrics.record_reauthentication(endpoint, self.crm_uuid)
+            response = metrics.measure_request(endpoint, self.crm_uuid, lambda: self.session.post(
+                url, data=self.credentials, headers={'Authorization': None}))
             if response.ok:
-                self.token = response.json()['token']
+                self.session.headers['Authorization'] = 'Token %s' % response.json()['token']
             else:
                 raise SugarCRMBackendError('Cannot authenticate as %s' % self.credentials['username'])
 
@@ -89,16 +261,16 @@ class SugarCRMBackend(SugarCRMBaseBackend):
             return url
 
         def _make_request(self, method, url, retry_if_authentication_fails=True, **kwargs):
-            if not hasattr(self, 'token'):
+            if 'Authorization' not in self.session.headers:
                 self.authenticate()
-            headers = kwargs.get('headers', {})
-            headers['Authorization'] = 'Token %s' % self.token
-            kwargs['headers'] = headers
-            kwargs['verify'] = kwargs.get('verify', False)
 
             url = self._prepare_url(url)
-            response = getattr(requests, method)(url, **kwargs)
+            endpoint = metrics.get_endpoint_name('nodeconductor', method, url)
+            response = metrics.measure_request(
+                endpoint, self.crm_uuid, lambda: self.session.request(method, url, **kwargs))
             if response.status_code == requests.status_codes.codes.unauthorized and retry_if_authentication_fails:
+                metrics.record_retry(endpoint, self.crm_uuid)
+                self.authenticate()
                 return self._make_request(method, url, retry_if_authentication_fails=False, **kwargs)
             else:
                 return response
@@ -119,31 +291,58 @@ class SugarCRMBackend(SugarCRMBaseBackend):
             INACTIVE = 'Inactive'
             RESERVED = 'Reserved'
 
-        def __init__(self, url, username, password):
+        # users fields that can be used in SugarCRM queries conditions
+        QUERY_FIELDS = ('user_name', 'first_name', 'last_name', 'status')
+        # pages are fetched with offsets, so they should be sorted by unique key to be stable
+        USERS_ORDER = 'users.user_name, users.id'
+
+        # users fields that are requested from SugarCRM if fields are not specified
+        USER_FIELDS = models.CRMUser.MIRRORED_FIELDS + ('id', 'is_admin', 'date_modified')
+
+        def __init__(self, url, username, password, page_size=100, parallelism=1, crm_uuid=''):
             self.v4_url = url + '/service/v4/rest.php'
             self.v10_url = url + '/rest/v10/'
             self.username = username
             self.password = password
-            self.v4_session = sugarcrm.Session(self.v4_url, username, password)
-
-        def execute_v10_request(self, method, url, json_data):
-            method = getattr(requests, method.lower())
-            if not hasattr(self, '_v10_headers'):
-                self._v10_headers = self._get_v10_headers()
-            return method(url, json=json_data, headers=self._v10_headers)
+            self.page_size = page_size
+            self.parallelism = parallelism
+            self.crm_uuid = crm_uuid
+            self.v4_session = SugarCRMSession(self.v4_url, username, password, crm_uuid=crm_uuid)
+            self.http_session = self.v4_session.http_session
+
+        def execute_v10_request(self, method, url, json_data, retry_if_authentication_fails=True):
+            headers = self._get_v10_headers()
+            endpoint = metrics.get_endpoint_name('sugarcrm-v10', method, url)
+            response = circuit_breaker.call(url, lambda: metrics.measure_request(
+                endpoint, self.crm_uuid, lambda: self.http_session.request(
+                    method, url, json=json_data, headers=headers, timeout=get_timeouts())))
+            if response.status_code == requests.status_codes.codes.unauthorized and retry_if_authentication_fails:
+                metrics.record_retry(endpoint, self.crm_uuid)
+                credentials_cache.invalidate(credentials_cache.Types.V10_TOKEN, self.v10_url, self.username)
+                return self.execute_v10_request(method, url, json_data, retry_if_authentication_fails=False)
+            return response
 
         def _get_v10_headers(self):
-            auth_url = self.v10_url + 'oauth2/token/'
-            json_data = {
-                'client_id': 'sugar',
-                'client_secret': '',
-                'grant_type': 'password',
-                'password': self.password,
-                'platform': 'base',
-                'username': self.username,
-            }
-            response = requests.post(auth_url, json=json_data).json()
-            return {'oauth-token': response['access_token']}
+            token = credentials_cache.get(credentials_cache.Types.V10_TOKEN, self.v10_url, self.username)
+            if token is None:
+                auth_url = self.v10_url + 'oauth2/token/'
+                json_data = {
+                    'client_id': 'sugar',
+                    'client_secret': '',
+                    'grant_type': 'password',
+                    'password': self.password,
+                    'platform': 'base',
+                    'username': self.username,
+                }
+                endpoint = metrics.get_endpoint_name('sugarcrm-v10', 'post', auth_url)
+                metrics.record_reauthentication(endpoint, self.crm_uuid)
+                response = circuit_breaker.call(auth_url, lambda: metrics.measure_request(
+                    endpoint, self.crm_uuid, lambda: self.http_session.post(
+                        auth_url, json=json_data, timeout=get_timeouts()))).json()
+                token = response['access_token']
+                credentials_cache.set(credentials_cache.Types.V10_TOKEN, self.v10_url, self.username,
+                                      token, response.get('expires_in', 3600))
+            return {'oauth-token': token}
 
         def create_user(self, **kwargs):
             user = sugarcrm.User()
@@ -156,27 +355,171 @@ class SugarCRMBackend(SugarCRMBaseBackend):
             if 'status' in kwargs:
                 url = self.v10_url + 'Users/%s/' % user.id
                 self.execute_v10_request('PUT', url, json_data={'status': kwargs['status']})
+            # only changed fields are sent, so fields that were changed on SugarCRM side are not overwritten
+            self.v4_session.set_entry(sugarcrm.User(id=user.id, **kwargs))
             for key, value in kwargs.items():
                 setattr(user, key, value)
-            return self.v4_session.set_entry(user)
-
-        def get_user(self, user_id):
-            return self.v4_session.get_entry('Users', user_id)
-
-        def list_users(self, **kwargs):
-            # admin users should not be visible
-            user_query = sugarcrm.User(is_admin='0')
-            user_count = self.v4_session.get_entries_count(user_query)
-
-            step = 100
+            return user
+
+        def create_users(self, users_kwargs):
+            users = [sugarcrm.User(**kwargs) for kwargs in users_kwargs]
+            return self._set_users(users)
+
+        def update_users(self, users_kwargs):
+            """ Update several users. Each kwargs should contain id of user and values of changed fields """
+            for kwargs in users_kwargs:
+                # It is possible to update user status only with v10 API
+                if 'status' in kwargs:
+                    url = self.v10_url + 'Users/%s/' % kwargs['id']
+                    self.execute_v10_request('PUT', url, json_data={'status': kwargs['status']})
+            users = [sugarcrm.User(**kwargs) for kwargs in users_kwargs]
+            return self._set_users(users)
+
+        def _set_users(self, users):
+            """ Create or update several users with one request """
+            result = self.v4_session._request(
+                'set_entries', [self.v4_session.session_id, sugarcrm.User.module, [user.fields for user in users]])
+            if 'ids' not in result:
+                raise sugarcrm.SugarError('Cannot save users: %s' % result)
+            for user, user_id in zip(users, result['ids']):
+                user.id = user_id
+            return users
+
+        def get_user(self, user_id, fields=None):
+            """ Get user by id or None if user does not exist """
+            result = self.v4_session._request('get_entry', [
+                self.v4_session.session_id, sugarcrm.User.module, user_id, self._get_select_fields(fields), [], False])
+            if 'entry_list' not in result:
+                raise sugarcrm.SugarError('Cannot get user %s: %s' % (user_id, result))
+            entry = result['entry_list'][0]
+            # SugarCRM returns list of warnings instead of fields for absent users
+            if not isinstance(entry['name_value_list'], dict):
+                return None
+            return self._get_user_from_entry(entry)
+
+        def get_users(self, user_ids, fields=None):
+            """ Get users with given ids with one get_entries request per page, absent users are skipped """
             users = []
-            for offset in range(0, user_count, step):
-                users += self.v4_session.get_entry_list(user_query, max_results=step, offset=offset)
+            for start in range(0, len(user_ids), self.page_size):
+                result = self.v4_session._request('get_entries', [
+                    self.v4_session.session_id, sugarcrm.User.module, user_ids[start:start + self.page_size],
+                    self._get_select_fields(fields), [], False])
+                if 'entry_list' not in result:
+                    raise sugarcrm.SugarError('Cannot get users: %s' % result)
+                users += [self._get_user_from_entry(entry) for entry in result['entry_list']
+                          # SugarCRM returns list of warnings instead of fields for absent users
+                          if isinstance(entry['name_value_list'], dict)]
+            return users
+
+        def _get_select_fields(self, fields=None):
+            """ Get fields that should be requested from SugarCRM, users ids are requested always """
+            fields = list(fields or self.USER_FIELDS)
+            return fields if 'id' in fields else ['id'] + fields
+
+        def _get_user_from_entry(self, entry):
+            user = sugarcrm.User()
+            for key, field in entry['name_value_list'].items():
+                setattr(user, key, field['value'])
+            return user
+
+        def list_users(self, fields=None, **kwargs):
+            if fields:
+                # fields are needed for filtering
+                fields = set(fields) | set(kwargs) | {'status'}
+            # admin users should not be visible
+            users = self._fetch_users(self._get_users_query(), fields=fields)
             # do not show users that are reserved by sugarcrm:
             users = [user for user in users if user.status != self.UserStatuses.RESERVED]
             # XXX: SugarCRM cannot filter 2 arguments together - its easier to filter users here.
             return [user for user in users if all(getattr(user, k) == v for k, v in kwargs.items())]
 
+        def list_users_modified_since(self, timestamp, deleted=False):
+            """ List non-admin users that were modified at or after given SugarCRM timestamp.
+
+            If <deleted> is True - only deleted users are listed.
+            """
+            query = self._get_users_query()
+            if timestamp:
+                query += " AND users.date_modified >= '%s'" % self._escape(timestamp)
+            return self._fetch_users(query, deleted=deleted)
+
+        def count_users(self, **kwargs):
+            """ Count non-admin users that match given filters on SugarCRM side """
+            return self._count_users(self._get_users_query(**kwargs))
+
+        def get_existing_user_names(self, user_names):
+            """ Get user names of users, including admins, that have any of given names """
+            query = self._get_in_condition('user_name', user_names)
+            return [user.user_name for user in self._fetch_users(query, fields=['user_name'])]
+
+        def count_visible_users(self, **kwargs):
+            """ Count non-admin and not reserved users that match given filters """
+            return self._count_users(self._get_visible_users_query(**kwargs))
+
+        def list_visible_users_page(self, offset, limit, fields=None, **kwargs):
+            """ Get one page of non-admin and not reserved users that match given filters """
+            return self._get_users_page(self._get_visible_users_query(**kwargs), offset, limit=limit, fields=fields)
+
+        def _get_visible_users_query(self, **kwargs):
+            return self._get_users_query(**kwargs) + " AND users.status <> '%s'" % self.UserStatuses.RESERVED
+
+        def _escape(self, value):
+            """ Escape value for MySQL string literal, backslash is an escape character too """
+            return six.text_type(value).replace('\\', '\\\\').replace("'", "''")
+
+        def _get_condition(self, field, value):
+            if field not in self.QUERY_FIELDS:
+                raise ValueError('Users cannot be filtered by field "%s".' % field)
+            return "users.%s = '%s'" % (field, self._escape(value))
+
+        def _get_in_condition(self, field, values):
+            if field not in self.QUERY_FIELDS:
+                raise ValueError('Users cannot be filtered by field "%s".' % field)
+            return 'users.%s IN (%s)' % (field, ', '.join("'%s'" % self._escape(value) for value in values))
+
+        def _get_users_query(self, **kwargs):
+            """ Build v4 API query for non-admin users with fields equal to given values """
+            conditions = ["users.is_admin = '0'"]
+            for key, value in sorted(kwargs.items()):
+                conditions.append(self._get_condition(key, value))
+            return ' AND '.join(conditions)
+
+        def _count_users(self, query, deleted=False):
+            result = self.v4_session._request(
+                'get_entries_count', [self.v4_session.session_id, sugarcrm.User.module, query, int(deleted)])
+            if 'result_count' not in result:
+                raise SugarCRMQueryError('Cannot count users with query "%s": %s' % (query, result))
+            return int(result['result_count'])
+
+        def _get_users_page(self, query, offset, limit=None, deleted=False, fields=None):
+            result = self.v4_session._request('get_entry_list', [
+                self.v4_session.session_id, sugarcrm.User.module, query, self.USERS_ORDER, offset,
+                self._get_select_fields(fields), [], limit or self.page_size, int(deleted), 0])
+            if 'entry_list' not in result:
+                raise sugarcrm.SugarError('Cannot get users with query "%s": %s' % (query, result))
+            return [self._get_user_from_entry(entry) for entry in result['entry_list']]
+
+        def _fetch_users(self, query, deleted=False, fields=None):
+            """ Fetch all users that match query page by page.
+
+            Pages are fetched concurrently by pool of threads, result keeps users order.
+            """
+            offsets = range(0, self._count_users(query, deleted=deleted), self.page_size)
+
+            def fetch_page(offset):
+                return self._get_users_page(query, offset, deleted=deleted, fields=fields)
+
+            if len(offsets) <= 1 or self.parallelism <= 1:
+                pages = [fetch_page(offset) for offset in offsets]
+            else:
+                pool = ThreadPool(min(self.parallelism, len(offsets)))
+                try:
+                    pages = pool.map(fetch_page, offsets)
+                finally:
+                    pool.close()
+                    pool.join()
+            return [user for page in pages for user in page]
+
         def delete_user(self, user):
             user.deleted = 1
             self.v4_session.set_entry(user)
@@ -186,7 +529,12 @@ class SugarCRMBackend(SugarCRMBaseBackend):
 
         self.template_url = self.settings.backend_url
         self.nc_client = self.NodeConductorOpenStackClient(
-            self.template_url, self.settings.username, self.settings.password)
+            self.template_url, self.settings.username, self.settings.password,
+            crm_uuid=self.crm.uuid.hex if self.crm is not None else '')
+
+    @property
+    def options(self):
+        return get_options(self.settings)
 
     @property
     def sugar_client(self):
@@ -195,18 +543,24 @@ class SugarCRMBackend(SugarCRMBaseBackend):
         if self.crm is None:
             raise SugarCRMBackendError('It is impossible to use sugar client if CRM is not specified for backend.')
         try:
-            self._sugar_client = self.SugarCRMClient(self.crm.api_url, self.crm.admin_username, self.crm.admin_password)
+            self._sugar_client = self.SugarCRMClient(
+                self.crm.api_url, self.crm.admin_username, self.crm.admin_password,
+                page_size=int(self.options['users_page_size']),
+                parallelism=int(self.options['users_fetch_parallelism']),
+                crm_uuid=self.crm.uuid.hex)
         except KeyError:
             raise SugarCRMBackendError('Cannot connect to CRM backend.')
+        except (sugarcrm.SugarError, requests.exceptions.RequestException) as e:
+            raise get_request_error(e, 'Cannot connect to CRM backend.')
         return self._sugar_client
 
     def schedule_crm_instance_provision(self, crm):
         # prepare data for template group provisioning
-        user_data = self.settings.get_option('user_data')
+        user_data = self.options['user_data']
         admin_username = self.CRM_ADMIN_NAME
         admin_password = pwgen()
         user_data = user_data.format(
-            password=admin_password, license_code=self.settings.get_option('license_code'))
+            password=admin_password, license_code=self.options['license_code'])
 
         template_data = [{
             'name': crm.name,
@@ -224,6 +578,9 @@ class SugarCRMBackend(SugarCRMBaseBackend):
         crm.admin_username = admin_username
         crm.backend_id = response.json()['url']
         crm.instance_url = response.json()['provisioned_resources']['OpenStack.Instance']
+        # instance will be resolved from new URL
+        crm.instance_content_type = None
+        crm.instance_object_id = None
         crm.save()
 
         logger.info('Successfully scheduled instance provision for CRM "%s"', crm.name)
@@ -248,8 +605,12 @@ class SugarCRMBackend(SugarCRMBaseBackend):
 
         logger.info('Successfully scheduled instance deletion for CRM "%s"', crm.name)
 
-    def pull_crm_sla(self, crm):
-        """ Copy OpenStack instance SLA and events as CRM events """
+    def pull_crm_sla(self, crm, full=False):
+        """ Copy OpenStack instance SLA and events as CRM events
+
+        Only SLA items and state transitions that are not older than CRM SLA watermarks are copied.
+        If <full> is True - all items are copied and CRM items that are absent in instance are removed.
+        """
         try:
             instance = crm.get_instance()
         except (Resolver404, ObjectDoesNotExist) as e:
@@ -259,20 +620,126 @@ class SugarCRMBackend(SugarCRMBaseBackend):
             logger.error(crm.error_message)
             six.reraise(SugarCRMBackendError, e)
         else:
-            for item in instance.sla_items.all():
-                crm.sla_items.update_or_create(
-                    period=item.period,
-                    defaults={'value': item.value, 'agreed_value': item.agreed_value},
-                )
-            for state_transition in instance.state_items.all():
-                crm.state_items.update_or_create(
-                    period=state_transition.period,
-                    timestamp=state_transition.timestamp,
-                    defaults={'state': state_transition.state},
-                )
+            self.copy_crms_sla({crm: instance}, full=full)
 
         logger.info('Successfully pulled SLA for CRM "%s"', crm.name)
 
+    @classmethod
+    def copy_crms_sla(cls, instances, full=False):
+        """ Copy SLA items and state transitions of several CRMs instances with few bulk queries.
+
+        <instances> is a dictionary with CRMs as keys and their instances as values.
+        """
+        if not instances:
+            return
+        with transaction.atomic():
+            # lock CRMs to advance watermarks consistently
+            crms = models.CRM.objects.select_for_update().filter(pk__in=[crm.pk for crm in instances])
+            instances = {crm: instances[crm] for crm in crms}
+            watermark_fields = ('sla_synced_period', 'sla_synced_timestamp')
+            old_watermarks = {crm.pk: {f: getattr(crm, f) for f in watermark_fields} for crm in instances}
+            # SLA periods are years ("YYYY") and months ("YYYY-MM"), yearly periods are compared with year
+            # of watermark, so current year SLA is copied while its months are copied
+            cls._copy_scoped_items(
+                monitoring_models.ResourceSla, instances, key_fields=('period',),
+                value_fields=('value', 'agreed_value'), watermark_field='period',
+                crm_watermark_field='sla_synced_period', full=full,
+                is_not_older=lambda period, watermark: period >= watermark[:len(period)],
+                get_lower_bound=lambda watermark: watermark[:4])
+            cls._copy_scoped_items(
+                monitoring_models.ResourceSlaStateTransition, instances, key_fields=('period', 'timestamp'),
+                value_fields=('state',), watermark_field='timestamp',
+                crm_watermark_field='sla_synced_timestamp', full=full)
+            # only advanced watermarks are saved
+            new_watermarks = {crm.pk: {f: getattr(crm, f) for f in watermark_fields} for crm in instances}
+            cls._update_rows(models.CRM, {pk: watermarks for pk, watermarks in new_watermarks.items()
+                                          if watermarks != old_watermarks[pk]})
+
+    @classmethod
+    def _copy_scoped_items(cls, model, instances, key_fields, value_fields, watermark_field, crm_watermark_field,
+                           full=False, is_not_older=operator.ge, get_lower_bound=lambda watermark: watermark):
+        """ Copy instances items of given model to CRMs and advance CRMs watermarks.
+
+        Items that are older than CRM watermark are skipped unless <full> is True. In full mode CRM items
+        that are absent in instance are removed.
+        <is_not_older> compares item watermark with CRM watermark, <get_lower_bound> returns minimal
+        item watermark that is selected from database for CRM watermark.
+        """
+        crm_content_type = ContentType.objects.get_for_model(models.CRM)
+        watermarks = {crm: None if full else getattr(crm, crm_watermark_field) or None for crm in instances}
+        known_watermarks = [w for w in watermarks.values() if w is not None]
+        min_watermark = min(known_watermarks) if len(known_watermarks) == len(watermarks) else None
+
+        def get_items_by_scope(queryset):
+            if min_watermark is not None:
+                queryset = queryset.filter(**{watermark_field + '__gte': get_lower_bound(min_watermark)})
+            items = collections.defaultdict(list)
+            for item in queryset:
+                items[(item.content_type_id, item.object_id)].append(item)
+            return items
+
+        instances_by_content_type = collections.defaultdict(list)
+        for instance in instances.values():
+            instances_by_content_type[ContentType.objects.get_for_model(instance)].append(instance.pk)
+        source_items = {}
+        for content_type, instances_pks in instances_by_content_type.items():
+            source_items.update(get_items_by_scope(
+                model.objects.filter(content_type=content_type, object_id__in=instances_pks)))
+        existing_items = get_items_by_scope(
+            model.objects.filter(content_type=crm_content_type, object_id__in=[crm.pk for crm in instances]))
+
+        new_items = []
+        changed_items = {}
+        stale_items_pks = []
+        for crm, instance in instances.items():
+            watermark = watermarks[crm]
+
+            def is_item_not_older(item):
+                return watermark is None or is_not_older(getattr(item, watermark_field), watermark)
+
+            crm_items = {tuple(getattr(item, f) for f in key_fields): item
+                         for item in existing_items[(crm_content_type.id, crm.pk)] if is_item_not_older(item)}
+            instance_content_type = ContentType.objects.get_for_model(instance)
+            instance_items = [item for item in source_items.get((instance_content_type.id, instance.pk), [])
+                              if is_item_not_older(item)]
+
+            for item in instance_items:
+                crm_item = crm_items.pop(tuple(getattr(item, f) for f in key_fields), None)
+                values = {f: getattr(item, f) for f in value_fields}
+                if crm_item is None:
+                    fields = {f: getattr(item, f) for f in key_fields}
+                    fields.update(values)
+                    new_items.append(model(content_type=crm_content_type, object_id=crm.pk, **fields))
+                elif any(getattr(crm_item, f) != value for f, value in values.items()):
+                    changed_items[crm_item.pk] = values
+            if full:
+                stale_items_pks += [item.pk for item in crm_items.values()]
+
+            item_watermarks = [getattr(item, watermark_field) for item in instance_items]
+            if item_watermarks:
+                setattr(crm, crm_watermark_field, max(item_watermarks))
+
+        model.objects.bulk_create(new_items)
+        cls._update_rows(model, changed_items)
+        if stale_items_pks:
+            model.objects.filter(pk__in=stale_items_pks).delete()
+
+    @classmethod
+    def _update_rows(cls, model, values_by_pk):
+        """ Update rows of model with different values by few queries.
+
+        <values_by_pk> is a dictionary with rows primary keys as keys and dictionaries
+        of fields values as values, all rows should have the same fields.
+        """
+        pks = sorted(values_by_pk)
+        for start in range(0, len(pks), cls.ROWS_UPDATE_BATCH_SIZE):
+            chunk = pks[start:start + cls.ROWS_UPDATE_BATCH_SIZE]
+            fields = values_by_pk[chunk[0]].keys()
+            model.objects.filter(pk__in=chunk).update(**{
+                field: Case(*[When(pk=pk, then=Value(values_by_pk[pk][field])) for pk in chunk],
+                            output_field=model._meta.get_field(field))
+                for field in fields})
+
     def get_crm_instance_details(self, crm):
         """ Get details of instance that corresponds given CRM """
         response = self.nc_client.get(crm.instance_url)
@@ -282,6 +749,52 @@ class SugarCRMBackend(SugarCRMBaseBackend):
                 'Request URL: %s' % (response.status_code, response.content, response.request.url))
         return response.json()
 
+    def get_crms_instances_details(self, crms):
+        """ Get details of instances of several CRMs with few list requests.
+
+        NC filters instances list only by one UUID, so instances are requested from lists filtered by
+        project and service settings of stored CRMs instances and are matched with CRMs by UUIDs.
+        Instances that are not stored yet or are absent in lists are requested one by one.
+        Returns dictionary with CRMs UUIDs as keys and instances details as values.
+        """
+        crms = [crm for crm in crms if crm.instance_url]
+        stored_instances = models.CRM.get_instances(crms)
+        scopes = {}
+        crms_by_list = collections.defaultdict(dict)
+        details = {}
+        for crm in crms:
+            instance = stored_instances.get(crm)
+            if instance is None:
+                details[crm.uuid.hex] = self.get_crm_instance_details(crm)
+                continue
+            scope_key = (type(instance), instance.service_project_link_id)
+            if scope_key not in scopes:
+                spl = instance.service_project_link
+                scopes[scope_key] = (spl.project.uuid.hex, spl.service.settings.uuid.hex)
+            list_url = crm.instance_url.rstrip('/').rsplit('/', 1)[0] + '/'
+            crms_by_list[(list_url,) + scopes[scope_key]][instance.uuid.hex] = crm
+
+        for (list_url, project_uuid, settings_uuid), crms_by_instance in crms_by_list.items():
+            url = list_url
+            params = {'project_uuid': project_uuid, 'service_settings_uuid': settings_uuid,
+                      'page_size': self.INSTANCES_LIST_PAGE_SIZE}
+            missed = dict(crms_by_instance)
+            while url and missed:
+                response = self.nc_client.get(url, params=params)
+                if not response.ok:
+                    raise SugarCRMBackendError(
+                        'Cannot get details of CRMs instances: response code - %s, response content: %s.'
+                        'Request URL: %s' % (response.status_code, response.content, response.request.url))
+                for instance in response.json():
+                    crm = missed.pop(instance['uuid'].replace('-', ''), None)
+                    if crm is not None:
+                        details[crm.uuid.hex] = instance
+                # next page URL already contains filters
+                url, params = response.links.get('next', {}).get('url'), None
+            for crm in missed.values():
+                details[crm.uuid.hex] = self.get_crm_instance_details(crm)
+        return details
+
     def get_crm_template_group_result_details(self, crm):
         """ Get details of CRMs template group provision result """
         if not crm.backend_id:
@@ -300,55 +813,296 @@ class SugarCRMBackend(SugarCRMBaseBackend):
             user = self.sugar_client.create_user(
                 user_name=user_name, user_hash=encoded_password, last_name=last_name, **kwargs)
         except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
-            raise SugarCRMBackendError(
-                'Cannot create user %s on CRM "%s". Error: %s' % (user_name, self.crm.name, e))
-
-        self.crm.add_quota_usage(self.crm.Quotas.user_count, 1)
+            raise get_request_error(
+                e, 'Cannot create user %s on CRM "%s". Error: %s' % (user_name, self.crm.name, e))
+
+        with transaction.atomic():
+            self._add_user_count(int(self._is_active(kwargs.get('status'))))
+            self._save_user_copy(user)
+        self._invalidate_reads()
+        cache.delete(self._get_free_user_name_cache_key(user_name))
         logger.info('Successfully created user "%s" for CRM "%s"', user_name, self.crm.name)
         return user
 
     def update_user(self, user, **kwargs):
         if 'password' in kwargs:
             kwargs['user_hash'] = self._encode_password(kwargs.pop('password'))
+        user_count_delta = self._get_user_count_delta(user, kwargs)
         try:
             user = self.sugar_client.update_user(user, **kwargs)
         except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
-            raise SugarCRMBackendError(
-                'Cannot update user %s on CRM "%s". Error: %s' % (user.user_name, self.crm.name, e))
+            raise get_request_error(
+                e, 'Cannot update user %s on CRM "%s". Error: %s' % (user.user_name, self.crm.name, e))
 
+        with transaction.atomic():
+            self._add_user_count(user_count_delta)
+            self._save_user_copy(user)
+        self._invalidate_reads()
         logger.info('Successfully updated user "%s" for CRM "%s"', user.user_name, self.crm.name)
         return user
 
+    def create_users(self, users_data):
+        """ Create several users with one request to SugarCRM.
+
+        Each item of <users_data> should contain user_name, password, last_name and other user fields.
+        User count quota usage is increased once for all users.
+        """
+        users_kwargs = []
+        for data in users_data:
+            kwargs = dict(data)
+            kwargs['user_hash'] = self._encode_password(kwargs.pop('password'))
+            users_kwargs.append(kwargs)
+        try:
+            users = self.sugar_client.create_users(users_kwargs)
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot create users on CRM "%s". Error: %s' % (self.crm.name, e))
+
+        with transaction.atomic():
+            self._add_user_count(sum(int(self._is_active(kwargs.get('status'))) for kwargs in users_kwargs))
+            for user in users:
+                self._save_user_copy(user)
+        self._invalidate_reads()
+        cache.delete_many([self._get_free_user_name_cache_key(user.user_name) for user in users])
+        logger.info('Successfully created %s users for CRM "%s"', len(users), self.crm.name)
+        return users
+
+    def update_users(self, updates):
+        """ Update several users with one request to SugarCRM.
+
+        <updates> is a list of pairs (user, changed fields values). Status of each user is updated
+        with separate request, because SugarCRM allows to change it only via v10 API.
+        Returns updated users with all fields that have local copies.
+        """
+        users_kwargs = []
+        new_users = []
+        user_count_delta = 0
+        for user, fields in updates:
+            user_count_delta += self._get_user_count_delta(user, fields)
+            kwargs = dict(fields, id=user.id)
+            if 'password' in kwargs:
+                kwargs['user_hash'] = self._encode_password(kwargs.pop('password'))
+            users_kwargs.append(kwargs)
+            new_user_kwargs = models.CRMUser.get_mirrored_values(user)
+            new_user_kwargs.update(kwargs)
+            new_users.append(sugarcrm.User(**new_user_kwargs))
+        try:
+            self.sugar_client.update_users(users_kwargs)
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot update users on CRM "%s". Error: %s' % (self.crm.name, e))
+
+        with transaction.atomic():
+            self._add_user_count(user_count_delta)
+            for user in new_users:
+                self._save_user_copy(user)
+        self._invalidate_reads()
+        logger.info('Successfully updated %s users for CRM "%s"', len(new_users), self.crm.name)
+        return new_users
+
+    def coalesce(self, operation, arguments, func):
+        """ Execute read operation of CRM once for all concurrent identical calls in process """
+        if isinstance(arguments, dict):
+            arguments = tuple(sorted(arguments.items()))
+        elif isinstance(arguments, tuple):
+            arguments = tuple(tuple(sorted(a.items())) if isinstance(a, dict) else a for a in arguments)
+        return single_flight.do((self.crm.uuid.hex, operation, arguments), func)
+
+    def _invalidate_reads(self):
+        """ Forget kept results of coalesced reads of CRM """
+        single_flight.forget(self.crm.uuid.hex)
+
     def _encode_password(self, password):
         return md5.new(password).hexdigest()
 
+    def _is_active(self, status):
+        # SugarCRM creates users as active if status is not defined
+        return (status or self.SugarCRMClient.UserStatuses.ACTIVE) == self.SugarCRMClient.UserStatuses.ACTIVE
+
+    def _get_user_count_delta(self, user, fields):
+        if 'status' not in fields:
+            return 0
+        return int(self._is_active(fields['status'])) - int(self._is_active(getattr(user, 'status', None)))
+
+    def _add_user_count(self, delta):
+        """ Change user count quota usage with locked quota row, should be called inside transaction """
+        if not delta:
+            return
+        quota = self.crm.quotas.select_for_update().get(name=self.crm.Quotas.user_count)
+        quota.usage += delta
+        quota.save(update_fields=['usage'])
+
     def delete_user(self, user):
         try:
             self.sugar_client.delete_user(user)
         except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
-            raise SugarCRMBackendError(
-                'Cannot delete user with id %s from CRM "%s". Error: %s' % (user.id, self.crm.name, e))
+            raise get_request_error(
+                e, 'Cannot delete user with id %s from CRM "%s". Error: %s' % (user.id, self.crm.name, e))
 
-        self.crm.add_quota_usage(self.crm.Quotas.user_count, -1)
+        with transaction.atomic():
+            self._add_user_count(-int(self._is_active(getattr(user, 'status', None))))
+            models.CRMUser.objects.filter(crm=self.crm, backend_id=user.id).delete()
+        self._invalidate_reads()
         logger.info('Successfully deleted user with id %s on CRM "%s"', user.id, self.crm.name)
 
-    def get_user(self, user_id):
+    def get_user(self, user_id, fields=()):
+        """ Get user from SugarCRM or None if user does not exist.
+
+        Only given fields are requested from SugarCRM if <fields> are defined.
+        """
+        fields = tuple(fields)
         try:
-            return self.sugar_client.get_user(user_id)
+            return self.coalesce('get_user', (user_id, fields), lambda: self.sugar_client.get_user(user_id, fields))
         except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
-            raise SugarCRMBackendError(
-                'Cannot get user with id %s from CRM "%s". Error: %s' % (user_id, self.crm.name, e))
+            raise get_request_error(
+                e, 'Cannot get user with id %s from CRM "%s". Error: %s' % (user_id, self.crm.name, e))
+
+    def get_users(self, user_ids, fields=()):
+        """ Get several users from SugarCRM with few requests.
+
+        Returns users in order of ids, absent users are skipped.
+        """
+        user_ids = list(user_ids)
+        if fields and 'id' not in fields:
+            fields = ['id'] + list(fields)
+        unique_ids = list(collections.OrderedDict.fromkeys(user_ids))
+        if not unique_ids:
+            return []
+        try:
+            users = {user.id: user for user in self.sugar_client.get_users(unique_ids, fields=fields)}
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot get users from CRM "%s". Error: %s' % (self.crm.name, e))
+        return [users[user_id] for user_id in user_ids if user_id in users]
+
+    def list_users(self, fields=(), **kwargs):
+        fields = tuple(fields)
+        try:
+            return self.coalesce(
+                'list_users', (fields, kwargs), lambda: self.sugar_client.list_users(fields=fields, **kwargs))
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot get users from CRM "%s". Error: %s' % (self.crm.name, e))
+
+    def user_name_exists(self, user_name):
+        """ Check if CRM already has user with given name """
+        return bool(self.get_existing_user_names([user_name]))
+
+    def get_existing_user_names(self, user_names):
+        """ Get names of CRM users that have any of given names.
+
+        Local copies of users are checked first, after that SugarCRM is requested once for the rest of names.
+        If NODECONDUCTOR_SUGARCRM['FREE_USER_NAMES_CACHE_TIMEOUT'] is defined - names that are not used
+        are cached for given number of seconds.
+        """
+        user_names = list(collections.OrderedDict.fromkeys(user_names))
+        existing_names = set(self.crm.users.filter(user_name__in=user_names).values_list('user_name', flat=True))
+        cache_timeout = get_plugin_setting('FREE_USER_NAMES_CACHE_TIMEOUT')
+        cache_keys = {name: self._get_free_user_name_cache_key(name)
+                      for name in user_names if name not in existing_names}
+        free_names = cache.get_many(cache_keys.values()) if cache_timeout else {}
+        unknown_names = [name for name, key in cache_keys.items() if key not in free_names]
+        if not unknown_names:
+            return existing_names
+
+        try:
+            backend_names = self.sugar_client.get_existing_user_names(unknown_names)
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(
+                e, 'Cannot check user names on CRM "%s". Error: %s' % (self.crm.name, e))
+        # SugarCRM compares names case-insensitively
+        backend_names = {name.lower() for name in backend_names}
+        for name in unknown_names:
+            if name.lower() in backend_names:
+                existing_names.add(name)
+        if cache_timeout:
+            cache.set_many({cache_keys[name]: True for name in unknown_names if name not in existing_names},
+                           cache_timeout)
+        return existing_names
+
+    def _get_free_user_name_cache_key(self, user_name):
+        user_name_hash = md5.new(user_name.encode('utf-8')).hexdigest()
+        return 'nodeconductor_sugarcrm:free_user_name:%s:%s' % (self.crm.uuid.hex, user_name_hash)
+
+    def get_users_list(self, fields=(), **filters):
+        """ Get lazy list of users that is fetched from SugarCRM page by page """
+        return SugarCRMUsersList(self, fields=fields, **filters)
+
+    def pull_users(self, full=False):
+        """ Update local copies of CRM users.
+
+        Only users that were modified after the latest pulled modification are requested from SugarCRM.
+        All users are pulled if <full> is True or if CRM users have never been pulled before.
+        """
+        watermark = None if full else self.crm.users_synced_until or None
+        try:
+            users = self.sugar_client.list_users_modified_since(watermark)
+            deleted_users = self.sugar_client.list_users_modified_since(watermark, deleted=True) if watermark else []
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot pull users from CRM "%s". Error: %s' % (self.crm.name, e))
+
+        reserved_users = [user for user in users if user.status == self.SugarCRMClient.UserStatuses.RESERVED]
+        users = [user for user in users if user.status != self.SugarCRMClient.UserStatuses.RESERVED]
+        with transaction.atomic():
+            if watermark is None:
+                # all copies are recreated with few bulk queries
+                self.crm.users.all().delete()
+                users_by_id = collections.OrderedDict((user.id, user) for user in users)
+                models.CRMUser.objects.bulk_create(
+                    [models.CRMUser(crm=self.crm, backend_id=user.id, **models.CRMUser.get_mirrored_values(user))
+                     for user in users_by_id.values()],
+                    batch_size=self.USER_COPIES_BATCH_SIZE)
+            else:
+                self.crm.users.filter(backend_id__in=[user.id for user in deleted_users + reserved_users]).delete()
+                for user in users:
+                    self._save_user_copy(user)
+
+            modification_times = [user.date_modified for user in users + deleted_users + reserved_users]
+            self.crm.users_synced_until = max(modification_times + [watermark or ''])
+            # watermark stays empty if CRM has no users, so pull is marked separately
+            self.crm.users_synced_at = timezone.now()
+            self.crm.save(update_fields=['users_synced_until', 'users_synced_at'])
 
-    def list_users(self, **kwargs):
+        logger.info('Successfully pulled %s users for CRM "%s"', len(users), self.crm.name)
+
+    def _save_user_copy(self, user):
+        models.CRMUser.objects.update_or_create(
+            crm=self.crm, backend_id=user.id, defaults=models.CRMUser.get_mirrored_values(user))
+
+    def count_users(self, **kwargs):
         try:
-            return self.sugar_client.list_users(**kwargs)
+            return self.sugar_client.count_users(**kwargs)
         except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
-            raise SugarCRMBackendError('Cannot get users from CRM "%s". Error: %s' % (self.crm.name, e))
+            raise get_request_error(e, 'Cannot count users on CRM "%s". Error: %s' % (self.crm.name, e))
 
     def sync_user_quota(self):
-        """ Sync CRM quotas with backend """
-        active_users = self.list_users(status=self.SugarCRMClient.UserStatuses.ACTIVE)
-        self.crm.set_quota_usage(self.crm.Quotas.user_count, len(active_users))
+        """ Reconcile CRM user count quota with backend, return actual users count.
+
+        User count quota is a counter of active users that is updated on users changes. It is compared
+        with active users count on SugarCRM that is requested with one count-only request.
+        If difference exceeds NODECONDUCTOR_SUGARCRM['USER_COUNT_DRIFT_THRESHOLD'] or SugarCRM responds
+        with error to count query - all users are pulled and counter is recounted from their local copies.
+        Connection errors and timeouts are raised, so unreachable CRM is not requested again.
+        """
+        status = self.SugarCRMClient.UserStatuses.ACTIVE
+        quota = self.crm.quotas.get(name=self.crm.Quotas.user_count)
+        try:
+            user_count = self.sugar_client.count_users(status=status)
+        except SugarCRMQueryError as e:
+            # some SugarCRM versions cannot filter users by several fields
+            logger.warning('Cannot count active users on CRM "%s" on backend side, users will be recounted. '
+                           'Error: %s', self.crm.name, e)
+            user_count = None
+        except (requests.exceptions.RequestException, sugarcrm.SugarError) as e:
+            raise get_request_error(e, 'Cannot count users on CRM "%s". Error: %s' % (self.crm.name, e))
+
+        drift = abs(user_count - quota.usage) if user_count is not None else None
+        if drift is None or drift > get_plugin_setting('USER_COUNT_DRIFT_THRESHOLD', 5):
+            if drift is not None:
+                logger.warning('User count of CRM "%s" differs from backend by %s, users will be recounted.',
+                               self.crm.name, drift)
+            self.pull_users(full=True)
+            user_count = self.crm.users.filter(status=status).count()
+        elif drift:
+            logger.info('User count of CRM "%s" is corrected by %s.', self.crm.name, user_count - quota.usage)
+        self.crm.set_quota_usage(self.crm.Quotas.user_count, user_count)
+        return user_count
 
     def get_stats(self):
         links = models.CRM.objects.filter(
@@ -0,0 +1,391 @@
+""" Benchmark of backend operations against local stub SugarCRM and NodeConductor servers """
+from __future__ import division
+
+import collections
+import json
+import re
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from nodeconductor.monitoring import models as monitoring_models
+from nodeconductor.structure import models as structure_models
+
+from . import models
+from .apps import SugarCRMConfig
+from .backend import SugarCRMBackend
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        parsed = urlparse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        result = self.server.stub.dispatch(self.command, parsed.path, urlparse.parse_qs(parsed.query), body)
+        status, data, headers = result if len(result) == 3 else result + ({},)
+        content = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    """ HTTP server that runs in background thread and responds after configured latency in seconds """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.requests_count = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _StubRequestHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def dispatch(self, method, path, query, body):
+        with self._lock:
+            self.requests_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handle(method, path, query, body)
+
+    def handle(self, method, path, query, body):
+        """ Return response status, data and optionally dictionary of headers """
+        raise NotImplementedError()
+
+
+class SugarCRMStubServer(StubServer):
+    """ Stub of SugarCRM v4 rest.php and v10 oauth2 and Users endpoints with <users_count> non-admin users """
+    CONDITION_REGEX = re.compile(r"users\.(\w+) = '((?:[^']|'')*)'")
+    IN_CONDITION_REGEX = re.compile(r"users\.(\w+) IN \(((?:'(?:[^']|'')*'(?:, )?)*)\)")
+    VALUE_REGEX = re.compile(r"'((?:[^']|'')*)'")
+
+    def __init__(self, users_count=100, latency=0):
+        super(SugarCRMStubServer, self).__init__(latency)
+        self.users = collections.OrderedDict()
+        for index in range(users_count):
+            self._save_user({'user_name': 'user%s' % index, 'last_name': 'User %s' % index, 'status': 'Active'})
+
+    def _save_user(self, fields):
+        user_id = fields.get('id') or uuid.uuid4().hex
+        user = self.users.setdefault(user_id, {
+            'id': user_id, 'is_admin': '0', 'status': 'Active', 'date_modified': '2016-01-01 00:00:00'})
+        user.update(fields)
+        return user_id
+
+    def _unescape(self, value):
+        return value.replace("''", "'").replace('\\\\', '\\')
+
+    def _filter_users(self, query):
+        conditions = [(field, [self._unescape(value)]) for field, value in self.CONDITION_REGEX.findall(query)]
+        conditions += [(field, [self._unescape(value) for value in self.VALUE_REGEX.findall(values)])
+                       for field, values in self.IN_CONDITION_REGEX.findall(query)]
+        return [user for user in self.users.values() if all(user.get(f) in v for f, v in conditions)]
+
+    def _serialize_user(self, user):
+        return {'id': user['id'], 'module_name': 'Users',
+                'name_value_list': {key: {'name': key, 'value': value} for key, value in user.items()}}
+
+    def handle(self, method, path, query, body):
+        if path.endswith('/service/v4/rest.php'):
+            data = urlparse.parse_qs(body)
+            return 200, self.handle_v4(data['method'][0], json.loads(data['rest_data'][0]))
+        if path.endswith('/oauth2/token/'):
+            return 200, {'access_token': uuid.uuid4().hex, 'expires_in': 3600}
+        if '/rest/v10/Users/' in path:
+            user_id = path.rstrip('/').rsplit('/', 1)[-1]
+            if method == 'PUT' and user_id in self.users:
+                self.users[user_id].update(json.loads(body))
+            return 200, {'id': user_id}
+        return 404, {}
+
+    def handle_v4(self, method, params):
+        if method == 'login':
+            return {'id': uuid.uuid4().hex}
+        if method == 'get_entries_count':
+            users = self._filter_users(params[2]) if not params[3] else []
+            return {'result_count': len(users)}
+        if method == 'get_entry_list':
+            offset, max_results, deleted = params[4], params[7], params[8]
+            users = self._filter_users(params[2]) if not deleted else []
+            page = users[offset:offset + max_results] if max_results else users[offset:]
+            return {'result_count': len(page), 'next_offset': offset + len(page),
+                    'entry_list': [self._serialize_user(user) for user in page], 'relationship_list': []}
+        if method == 'get_entry':
+            user = self.users.get(params[2])
+            entry = self._serialize_user(user) if user else {'name_value_list': [{'name': 'deleted', 'value': 1}]}
+            return {'entry_list': [entry], 'relationship_list': []}
+        if method == 'get_entries':
+            users = [self.users[user_id] for user_id in params[2] if user_id in self.users]
+            return {'entry_list': [self._serialize_user(user) for user in users], 'relationship_list': []}
+        if method == 'set_entry':
+            return {'id': self._save_user({field['name']: field['value'] for field in params[2]})}
+        if method == 'set_entries':
+            return {'ids': [self._save_user({field['name']: field['value'] for field in fields})
+                            for fields in params[2]]}
+        return {'name': 'Invalid Method', 'number': 20}
+
+
+class NodeConductorStubServer(StubServer):
+    """ Stub of NodeConductor auth-password, template group and OpenStack instances endpoints.
+
+    Instances list contains instances that are added to stub, it is filtered by project and service settings
+    UUIDs and by one instance UUID as NC resources filter does and it is paginated with Link header.
+    Details of any instance can be requested.
+    """
+    DEFAULT_PAGE_SIZE = 10
+
+    def __init__(self, latency=0, instance_ip='127.0.0.1'):
+        super(NodeConductorStubServer, self).__init__(latency)
+        self.instance_ip = instance_ip
+        self.template_url = self.url + '/api/templates-groups/%s/' % uuid.uuid4().hex
+        self.instances = collections.OrderedDict()
+
+    def add_instance(self, instance_uuid, project_uuid, service_settings_uuid):
+        """ Add instance to instances list """
+        with self._lock:
+            self.instances[instance_uuid] = {
+                'project_uuid': project_uuid, 'service_settings_uuid': service_settings_uuid}
+        return self.url + '/api/openstack-instances/%s/' % instance_uuid
+
+    def _get_instance(self, instance_uuid):
+        return {'uuid': instance_uuid, 'url': self.url + '/api/openstack-instances/%s/' % instance_uuid,
+                'state': 'Online', 'external_ips': [self.instance_ip]}
+
+    def _get_template_result(self, result_uuid):
+        return {'url': self.url + '/api/template-results/%s/' % result_uuid,
+                'is_finished': True, 'is_erred': False, 'state_message': 'OK', 'error_message': '',
+                'provisioned_resources': {'OpenStack.Instance': self._get_instance(result_uuid)['url']}}
+
+    def _list_instances(self, query):
+        with self._lock:
+            instances = list(self.instances.items())
+        for name in ('project_uuid', 'service_settings_uuid'):
+            if query.get(name):
+                instances = [(i, scope) for i, scope in instances if scope[name] == query[name][-1]]
+        if query.get('uuid'):
+            # only the last of several UUIDs is applied by NC filter
+            instances = [(i, scope) for i, scope in instances if i == query['uuid'][-1]]
+        page = int(query.get('page', ['1'])[-1])
+        page_size = int(query.get('page_size', [self.DEFAULT_PAGE_SIZE])[-1])
+        headers = {}
+        if page * page_size < len(instances):
+            next_query = dict(query, page=[str(page + 1)])
+            next_url = self.url + '/api/openstack-instances/?' + urllib.urlencode(next_query, doseq=True)
+            headers['Link'] = '<%s>; rel="next"' % next_url
+        page_instances = instances[(page - 1) * page_size:page * page_size]
+        return 200, [self._get_instance(instance_uuid) for instance_uuid, _ in page_instances], headers
+
+    def handle(self, method, path, query, body):
+        if path == reverse('auth-password'):
+            return 200, {'token': uuid.uuid4().hex}
+        if path.endswith('/provision/'):
+            return 200, self._get_template_result(uuid.uuid4().hex)
+        match = re.match(r'^/api/template-results/(\w+)/$', path)
+        if match:
+            return 200, self._get_template_result(match.group(1))
+        if path == '/api/openstack-instances/':
+            return self._list_instances(query)
+        match = re.match(r'^/api/openstack-instances/(\w+)/(stop/)?$', path)
+        if match:
+            if method == 'DELETE':
+                return 204, None
+            return 200, self._get_instance(match.group(1))
+        return 404, {}
+
+
+Result = collections.namedtuple(
+    'Result', ('operation', 'iterations', 'throughput', 'p50', 'p99', 'sugarcrm_requests', 'nc_requests', 'queries'))
+
+
+class Benchmark(object):
+    """ Measure backend operations with CRM that is served by stub servers.
+
+    CRM and its structure are created in transaction that is rolled back after benchmark,
+    so benchmark can be executed against any database. Existing CRMs are not used.
+    Instances polling and SLA copying are measured with <crms_count> CRMs.
+    """
+    OPERATIONS = ('provision', 'poll_instances', 'count_users', 'sync_user_quota', 'list_users', 'pull_users',
+                  'pull_sla')
+
+    def __init__(self, users_count=100, latency=0, iterations=10, page_size=100, parallelism=4, crms_count=100):
+        self.users_count = users_count
+        self.latency = latency
+        self.iterations = iterations
+        self.page_size = page_size
+        self.parallelism = parallelism
+        self.crms_count = crms_count
+
+    def run(self, operations=OPERATIONS):
+        self.sugarcrm_server = SugarCRMStubServer(users_count=self.users_count, latency=self.latency)
+        self.nc_server = NodeConductorStubServer(latency=self.latency)
+        self.sugarcrm_server.start()
+        self.nc_server.start()
+        results = []
+        try:
+            with transaction.atomic():
+                self.crm = self._create_crm()
+                for operation in operations:
+                    result = self.measure(operation)
+                    if result is not None:
+                        results.append(result)
+                transaction.set_rollback(True)
+        finally:
+            self.sugarcrm_server.stop()
+            self.nc_server.stop()
+        return results
+
+    def _create_crm(self):
+        settings = structure_models.ServiceSettings.objects.create(
+            name='Benchmark', type=SugarCRMConfig.service_name, backend_url=self.nc_server.template_url,
+            username='benchmark', password='benchmark',
+            options={'users_page_size': self.page_size, 'users_fetch_parallelism': self.parallelism})
+        customer = structure_models.Customer.objects.create(name='Benchmark')
+        project = structure_models.Project.objects.create(name='Benchmark', customer=customer)
+        service = models.SugarCRMService.objects.create(name='Benchmark', customer=customer, settings=settings)
+        spl = models.SugarCRMServiceProjectLink.objects.create(service=service, project=project)
+        instance_uuid = uuid.uuid4().hex
+        return models.CRM.objects.create(
+            name='Benchmark', service_project_link=spl, state=models.CRM.States.ONLINE,
+            api_url=self.sugarcrm_server.url, admin_username='admin', admin_password='admin',
+            backend_id=self.nc_server.url + '/api/template-results/%s/' % instance_uuid,
+            instance_url=self.nc_server.url + '/api/openstack-instances/%s/' % instance_uuid)
+
+    def _create_crms_with_instances(self, count, kind):
+        """ Create CRMs with stored instances that are listed by stub NodeConductor.
+
+        Instances are represented by other CRMs that are created by benchmark too,
+        so operations do not use or lock existing CRMs and instances.
+        Returns dictionary with CRMs as keys and their instances as values.
+        """
+        spl = self.crm.service_project_link
+        crm_content_type = ContentType.objects.get_for_model(models.CRM)
+        crm_kwargs = {'service_project_link': spl, 'state': models.CRM.States.ONLINE,
+                      'api_url': self.sugarcrm_server.url, 'admin_username': 'admin', 'admin_password': 'admin'}
+        instances = {}
+        for index in range(count):
+            instance = models.CRM.objects.create(name='Benchmark %s instance %s' % (kind, index), **crm_kwargs)
+            instance_url = self.nc_server.add_instance(
+                instance.uuid.hex, spl.project.uuid.hex, spl.service.settings.uuid.hex)
+            crm = models.CRM.objects.create(
+                name='Benchmark %s CRM %s' % (kind, index), instance_url=instance_url,
+                instance_content_type=crm_content_type, instance_object_id=instance.pk, **crm_kwargs)
+            instances[crm] = instance
+        return instances
+
+    def _create_sla_crms(self):
+        """ Create CRMs and SLA items of their instances for SLA copying """
+        crm_content_type = ContentType.objects.get_for_model(models.CRM)
+        now = timezone.now()
+        periods = [str(now.year)] + ['%s-%02d' % (now.year, month) for month in range(1, now.month + 1)]
+        instances = self._create_crms_with_instances(self.crms_count, 'SLA')
+        sla_items = []
+        transitions = []
+        for instance in instances.values():
+            scope = {'content_type': crm_content_type, 'object_id': instance.pk}
+            sla_items += [monitoring_models.ResourceSla(period=period, value=99.5, agreed_value=95, **scope)
+                          for period in periods]
+            transitions += [monitoring_models.ResourceSlaStateTransition(
+                period=periods[-1], timestamp=int(time.time()) - offset, state=bool(offset % 2), **scope)
+                for offset in range(10)]
+        monitoring_models.ResourceSla.objects.bulk_create(sla_items)
+        monitoring_models.ResourceSlaStateTransition.objects.bulk_create(transitions)
+        return instances
+
+    def get_operation(self, name):
+        """ Return function that executes operation once or None if operation cannot be executed """
+        crm = self.crm
+
+        def backend():
+            return crm.get_backend()
+
+        if name == 'provision':
+            def provision():
+                b = backend()
+                b.schedule_crm_instance_provision(crm)
+                b.get_crm_template_group_result_details(crm)
+                b.get_crm_instance_details(crm)
+                b.sync_user_quota()
+            return provision
+        if name == 'poll_instances':
+            # instances of all CRMs are stored, so they are fetched with instances list requests
+            polled_crms = list(self._create_crms_with_instances(self.crms_count, 'polling'))
+            return lambda: backend().get_crms_instances_details(polled_crms)
+        if name == 'count_users':
+            return lambda: backend().count_users()
+        if name == 'sync_user_quota':
+            return lambda: backend().sync_user_quota()
+        if name == 'list_users':
+            return lambda: backend().list_users()
+        if name == 'pull_users':
+            return lambda: backend().pull_users(full=True)
+        if name == 'pull_sla':
+            # SLA is copied between CRMs that are created by benchmark, stub servers are not used
+            instances = self._create_sla_crms()
+            return lambda: SugarCRMBackend.copy_crms_sla(instances, full=True)
+        raise ValueError('Unknown operation %s' % name)
+
+    def measure(self, name):
+        operation = self.get_operation(name)
+        if operation is None:
+            return None
+        sugarcrm_requests, nc_requests = self.sugarcrm_server.requests_count, self.nc_server.requests_count
+        durations = []
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            for _ in range(self.iterations):
+                iteration_start = time.time()
+                operation()
+                durations.append(time.time() - iteration_start)
+            total = time.time() - start
+        durations.sort()
+
+        def percentile(p):
+            return durations[min(int(len(durations) * p / 100), len(durations) - 1)]
+
+        return Result(
+            operation=name,
+            iterations=self.iterations,
+            throughput=self.iterations / total if total else 0,
+            p50=percentile(50),
+            p99=percentile(99),
+            sugarcrm_requests=(self.sugarcrm_server.requests_count - sugarcrm_requests) / self.iterations,
+            nc_requests=(self.nc_server.requests_count - nc_requests) / self.iterations,
+            queries=len(queries) / self.iterations,
+        )
@@ -0,0 +1,144 @@
+import copy
+import hashlib
+import sys
+import threading
+import time
+
+from django.core.cache import caches
+from django.utils import six
+
+from .utils import get_plugin_setting
+
+
+class CredentialsCache(object):
+    """ Storage for SugarCRM v4 session ids and v10 OAuth tokens.
+
+    Credentials are stored in process memory. If NODECONDUCTOR_SUGARCRM['CREDENTIALS_CACHE'] is defined
+    they are also stored in Django cache with such alias, so all API processes and Celery workers share them.
+    Credentials are considered expired REFRESH_MARGIN seconds before their real expiration time
+    to refresh them proactively.
+    """
+    REFRESH_MARGIN = 60
+
+    class Types(object):
+        V4_SESSION = 'v4'
+        V10_TOKEN = 'v10'
+
+    def __init__(self):
+        self._credentials = {}
+        self._lock = threading.Lock()
+
+    def _get_django_cache(self):
+        alias = get_plugin_setting('CREDENTIALS_CACHE')
+        return caches[alias] if alias else None
+
+    def _get_key(self, credentials_type, url, username):
+        url_hash = hashlib.md5(('%s:%s' % (url, username)).encode('utf-8')).hexdigest()
+        return 'nodeconductor_sugarcrm:credentials:%s:%s' % (credentials_type, url_hash)
+
+    def get(self, credentials_type, url, username):
+        """ Return cached token or None if it is absent or going to expire soon """
+        key = self._get_key(credentials_type, url, username)
+        with self._lock:
+            value = self._credentials.get(key)
+        if value is None:
+            django_cache = self._get_django_cache()
+            if django_cache is not None:
+                value = django_cache.get(key)
+                if value is not None:
+                    with self._lock:
+                        self._credentials[key] = value
+        if value is None or value['expires_at'] - self.REFRESH_MARGIN < time.time():
+            return None
+        return value['token']
+
+    def set(self, credentials_type, url, username, token, lifetime):
+        key = self._get_key(credentials_type, url, username)
+        value = {'token': token, 'expires_at': time.time() + lifetime}
+        with self._lock:
+            self._credentials[key] = value
+        django_cache = self._get_django_cache()
+        if django_cache is not None:
+            django_cache.set(key, value, timeout=lifetime)
+
+    def invalidate(self, credentials_type, url, username):
+        key = self._get_key(credentials_type, url, username)
+        with self._lock:
+            self._credentials.pop(key, None)
+        django_cache = self._get_django_cache()
+        if django_cache is not None:
+            django_cache.delete(key)
+
+
+credentials_cache = CredentialsCache()
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.is_interrupted = True
+
+
+class SingleFlight(object):
+    """ Coalescing of concurrent identical calls in process.
+
+    If call with the same key is in progress - caller waits for its result instead of new execution.
+    Results are kept for NODECONDUCTOR_SUGARCRM['SINGLE_FLIGHT_TTL'] seconds (default: 2).
+    Each caller gets its own copy of result, so results can be changed by callers.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.time():
+                return copy.deepcopy(cached[1])
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if is_leader:
+            try:
+                call.result = func()
+                call.is_interrupted = False
+            except Exception:
+                call.exc_info = sys.exc_info()
+                call.is_interrupted = False
+            finally:
+                # call is interrupted by BaseException (e.g. task time limit) - it is cleaned up anyway,
+                # so followers and next callers do not wait forever
+                ttl = get_plugin_setting('SINGLE_FLIGHT_TTL', 2)
+                with self._lock:
+                    del self._calls[key]
+                    if not call.is_interrupted and call.exc_info is None and ttl:
+                        now = time.time()
+                        self._results = {k: v for k, v in self._results.items() if v[0] > now}
+                        self._results[key] = (now + ttl, call.result)
+                call.done.set()
+        else:
+            call.done.wait()
+            if call.is_interrupted:
+                # leader has not got result, one of followers executes call again
+                return self.do(key, func)
+
+        if call.exc_info is not None:
+            six.reraise(*call.exc_info)
+        return copy.deepcopy(call.result)
+
+    def forget(self, group):
+        """ Remove kept results of calls with keys that start with given group """
+        with self._lock:
+            for key in list(self._results):
+                if key[0] == group:
+                    del self._results[key]
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import time
+import urlparse
+
+from django.core.cache import caches
+import requests
+
+from .utils import get_plugin_setting
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ Request was not executed because host is considered unreachable """
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker for requests to CRMs hosts.
+
+    Circuit of host is opened if FAILURE_THRESHOLD connection errors, timeouts or gateway errors
+    happen during RESET_TIMEOUT seconds. Requests to host with open circuit fail immediately.
+    After RESET_TIMEOUT seconds circuit becomes half-open - one probe request is executed and
+    circuit is closed if it succeeds or opened again if it fails.
+    Circuits states are stored in Django cache with alias NODECONDUCTOR_SUGARCRM['CIRCUIT_BREAKER_CACHE']
+    (default: "default"), so all API processes and Celery workers share them.
+    """
+    FAILURE_STATUSES = (502, 503, 504)
+    # time in seconds during which host is considered unreachable without requests
+    OPEN_STATE_LIFETIME = 24 * 60 * 60
+
+    class States(object):
+        CLOSED = 'closed'
+        OPEN = 'open'
+        HALF_OPEN = 'half-open'
+
+    @property
+    def failure_threshold(self):
+        return get_plugin_setting('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 3)
+
+    @property
+    def reset_timeout(self):
+        return get_plugin_setting('CIRCUIT_BREAKER_RESET_TIMEOUT', 60)
+
+    def _get_cache(self):
+        return caches[get_plugin_setting('CIRCUIT_BREAKER_CACHE', 'default')]
+
+    def _get_key(self, url, name):
+        parsed = urlparse.urlparse(url)
+        host_hash = hashlib.md5(('%s://%s' % (parsed.scheme, parsed.netloc)).encode('utf-8')).hexdigest()
+        return 'nodeconductor_sugarcrm:circuit:%s:%s' % (host_hash, name)
+
+    def get_state(self, url):
+        opened_at = self._get_cache().get(self._get_key(url, 'opened_at'))
+        if opened_at is None:
+            return self.States.CLOSED
+        if time.time() - opened_at < self.reset_timeout:
+            return self.States.OPEN
+        return self.States.HALF_OPEN
+
+    def call(self, url, send):
+        """ Execute send() if circuit of url host is not open, track its errors """
+        state = self.get_state(url)
+        if state == self.States.OPEN:
+            raise CircuitOpenError('Host of %s is unreachable, request is not executed.' % url)
+        probe_key = self._get_key(url, 'probe')
+        if state == self.States.HALF_OPEN and not self._get_cache().add(probe_key, True, self.reset_timeout):
+            raise CircuitOpenError('Host of %s is unreachable and is being probed, request is not executed.' % url)
+
+        try:
+            response = send()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self._record_failure(url, state)
+            raise
+        else:
+            if response.status_code in self.FAILURE_STATUSES:
+                self._record_failure(url, state)
+            elif state == self.States.HALF_OPEN:
+                self._close(url)
+            return response
+        finally:
+            if state == self.States.HALF_OPEN:
+                self._get_cache().delete(probe_key)
+
+    def _record_failure(self, url, state):
+        cache = self._get_cache()
+        if state == self.States.HALF_OPEN:
+            self._open(url)
+            return
+        failures_key = self._get_key(url, 'failures')
+        cache.add(failures_key, 0, self.reset_timeout)
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            # key has expired between add and incr
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._open(url)
+
+    def _open(self, url):
+        logger.warning('Circuit of %s host is opened, its requests will fail during %s seconds.',
+                       url, self.reset_timeout)
+        cache = self._get_cache()
+        cache.set(self._get_key(url, 'opened_at'), time.time(), self.OPEN_STATE_LIFETIME)
+        cache.delete(self._get_key(url, 'failures'))
+
+    def _close(self, url):
+        logger.info('Circuit of %s host is closed.', url)
+        self._get_cache().delete_many([self._get_key(url, 'opened_at'), self._get_key(url, 'failures')])
+
+
+circuit_breaker = CircuitBreaker()
+
+
+def get_timeouts():
+    """ Get connect and read timeouts for requests to CRMs """
+    return (get_plugin_setting('CRM_CONNECT_TIMEOUT', 5), get_plugin_setting('CRM_READ_TIMEOUT', 60))
@@ -0,0 +1,103 @@
+import collections
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+
+from .backend import SugarCRMBackendError
+from .utils import get_plugin_setting
+
+
+logger = logging.getLogger(__name__)
+
+
+Outcome = collections.namedtuple('Outcome', ('result', 'error', 'latency'))
+
+
+class BatchEngine(object):
+    """ Executes backend operations of many CRMs concurrently in one process.
+
+    Operations are executed by pool of threads, so one worker can poll or sync hundreds of CRMs
+    while their requests wait for NC and SugarCRM responses. HTTP connections are shared by threads
+    through process-wide HTTP sessions of backend.
+    Concurrency is defined by NODECONDUCTOR_SUGARCRM['BATCH_ENGINE_CONCURRENCY'] (default: 20).
+    """
+    DEFAULT_CONCURRENCY = 20
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or get_plugin_setting('BATCH_ENGINE_CONCURRENCY', self.DEFAULT_CONCURRENCY)
+
+    def execute(self, operation, items):
+        """ Execute operation for each item concurrently.
+
+        Returns ordered dictionary with items as keys and outcomes as values.
+        Operation errors are returned as outcomes errors and do not interrupt other operations.
+        """
+        items = list(items)
+        if not items:
+            return collections.OrderedDict()
+
+        def execute_one(item):
+            start = time.time()
+            try:
+                return Outcome(operation(item), None, time.time() - start)
+            except Exception as e:
+                logger.warning('Batch engine operation failed for %s. Error: %s', item, e)
+                return Outcome(None, e, time.time() - start)
+            finally:
+                # each thread opens its own DB connection, it should not stay open after operation
+                connection.close()
+
+        pool = ThreadPool(min(self.concurrency, len(items)))
+        try:
+            outcomes = pool.map(execute_one, items)
+        finally:
+            pool.close()
+            pool.join()
+        return collections.OrderedDict(zip(items, outcomes))
+
+    def execute_for_crms(self, crms, operation):
+        """ Execute operation(backend, crm) for each CRM concurrently.
+
+        CRMs backends are initialized in current thread, so operations threads do not query their settings.
+        """
+        crms = list(crms)
+        backends = {crm: crm.get_backend() for crm in crms}
+        return self.execute(lambda crm: operation(backends[crm], crm), crms)
+
+    def get_crms_instances_details(self, crms):
+        """ Get details of CRMs instances with few list requests per service settings.
+
+        Instances of different service settings are fetched concurrently.
+        """
+        crms_by_settings = collections.OrderedDict()
+        for crm in crms:
+            crms_by_settings.setdefault(crm.service_project_link.service.settings, []).append(crm)
+        # instances of all CRMs of service settings are fetched by backend of its first CRM
+        settings_outcomes = self.execute_for_crms(
+            [settings_crms[0] for settings_crms in crms_by_settings.values()],
+            lambda backend, crm: backend.get_crms_instances_details(
+                crms_by_settings[crm.service_project_link.service.settings]))
+
+        outcomes = collections.OrderedDict()
+        for first_crm, outcome in settings_outcomes.items():
+            for crm in crms_by_settings[first_crm.service_project_link.service.settings]:
+                if outcome.error is not None:
+                    outcomes[crm] = outcome
+                elif crm.uuid.hex in outcome.result:
+                    outcomes[crm] = outcome._replace(result=outcome.result[crm.uuid.hex])
+                else:
+                    error = SugarCRMBackendError('Cannot get instance details of CRM "%s".' % crm.name)
+                    outcomes[crm] = outcome._replace(result=None, error=error)
+        return outcomes
+
+    def get_crms_template_group_results(self, crms):
+        return self.execute_for_crms(
+            crms, lambda backend, crm: backend.get_crm_template_group_result_details(crm))
+
+    def count_crms_users(self, crms, **filters):
+        return self.execute_for_crms(crms, lambda backend, crm: backend.count_users(**filters))
+
+    def sync_crms_user_quotas(self, crms):
+        return self.execute_for_crms(crms, lambda backend, crm: backend.sync_user_quota())
@@ -21,8 +21,25 @@ class SugarCRMExtension(NodeConductorExtension):
                 'schedule': timedelta(days=1),
                 'args': ()
             },
+            'sugarcrm-pull-crms-users': {
+                'task': 'nodeconductor.sugarcrm.pull_crms_users',
+                'schedule': timedelta(minutes=10),
+            },
+            'sugarcrm-poll-crms-instances': {
+                'task': 'nodeconductor.sugarcrm.poll_crms_instances',
+                'schedule': timedelta(seconds=30),
+            },
             'sugarcrm-pull-sla': {
                 'task': 'nodeconductor.sugarcrm.pull_sla',
                 'schedule': timedelta(minutes=5),
             },
+            'sugarcrm-probe-crms-circuits': {
+                'task': 'nodeconductor.sugarcrm.probe_crms_circuits',
+                'schedule': timedelta(minutes=1),
+            },
+            'sugarcrm-reconcile-sla': {
+                'task': 'nodeconductor.sugarcrm.pull_sla',
+                'schedule': timedelta(days=1),
+                'kwargs': {'full': True},
+            },
         }
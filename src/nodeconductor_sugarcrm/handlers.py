@@ -1,4 +1,4 @@
-from . import log
+from . import log, utils
 
 
 event_logger = log.event_logger
@@ -51,3 +51,8 @@ def log_user_post_delete(sender, user, crm, **kwargs):
             'user_name': user.user_name,
             'crm': crm,
         })
+
+
+def invalidate_service_settings_options(sender, instance, **kwargs):
+    utils.invalidate_options(instance)
+
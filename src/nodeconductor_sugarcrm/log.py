@@ -18,4 +18,15 @@ class SugarCRMUserEventLogger(EventLogger):
         )
 
 
+class SugarCRMUsersBulkEventLogger(EventLogger):
+    crm = CRM
+    created_count = int
+    updated_count = int
+    deactivated_count = int
+
+    class Meta:
+        event_types = ('sugarcrm_users_bulk_operation_succeeded',)
+
+
 event_logger.register('sugarcrm_user', SugarCRMUserEventLogger)
+event_logger.register('sugarcrm_users_bulk', SugarCRMUsersBulkEventLogger)
@@ -0,0 +1,52 @@
+from __future__ import division
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmark import Benchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark SugarCRM backend operations against local stub SugarCRM and NodeConductor servers. "
+            "All created objects are removed after benchmark.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=100,
+                    help='Number of users on stub SugarCRM (default: 100).'),
+        make_option('--latency', dest='latency', type='float', default=0,
+                    help='Latency of stub servers responses in milliseconds (default: 0).'),
+        make_option('--iterations', dest='iterations', type='int', default=10,
+                    help='Number of executions of each operation (default: 10).'),
+        make_option('--page-size', dest='page_size', type='int', default=100,
+                    help='Value of "users_page_size" option (default: 100).'),
+        make_option('--parallelism', dest='parallelism', type='int', default=4,
+                    help='Value of "users_fetch_parallelism" option (default: 4).'),
+        make_option('--crms', dest='crms', type='int', default=100,
+                    help='Number of CRMs for poll_instances and pull_sla operations (default: 100).'),
+        make_option('--operations', dest='operations', default=','.join(Benchmark.OPERATIONS),
+                    help='Comma-separated list of operations (default: %s).' % ','.join(Benchmark.OPERATIONS)),
+    )
+
+    def handle(self, *args, **options):
+        operations = [operation for operation in options['operations'].split(',') if operation]
+        unknown_operations = set(operations) - set(Benchmark.OPERATIONS)
+        if unknown_operations:
+            raise CommandError('Unknown operations: %s' % ', '.join(sorted(unknown_operations)))
+
+        benchmark = Benchmark(
+            users_count=options['users'],
+            latency=options['latency'] / 1000,
+            iterations=options['iterations'],
+            page_size=options['page_size'],
+            parallelism=options['parallelism'],
+            crms_count=options['crms'],
+        )
+        row_format = '{:<16} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'
+        self.stdout.write(row_format.format(
+            'operation', 'iterations', 'ops/s', 'p50 ms', 'p99 ms', 'crm req', 'nc req', 'queries'))
+        for result in benchmark.run(operations):
+            self.stdout.write(row_format.format(
+                result.operation, result.iterations, '%.2f' % result.throughput,
+                '%.1f' % (result.p50 * 1000), '%.1f' % (result.p99 * 1000),
+                '%.1f' % result.sugarcrm_requests, '%.1f' % result.nc_requests, '%.1f' % result.queries))
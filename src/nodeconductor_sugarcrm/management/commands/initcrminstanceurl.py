@@ -11,6 +11,8 @@ class Command(BaseCommand):
             try:
                 b = crm.get_backend()
                 crm.instance_url = b.get_crm_template_group_result_details(crm)['provisioned_resources']['OpenStack.Instance']
+                crm.instance_content_type = None
+                crm.instance_object_id = None
                 crm.save()
             except Exception as e:
                 self.stdout.write('Cannot initialize isntance_url for CRM: %s (UUID: %s). Error: %s' % (
@@ -0,0 +1,223 @@
+""" Instrumentation of backend HTTP requests to SugarCRM and NodeConductor """
+import bisect
+import collections
+import functools
+import logging
+import re
+import threading
+import time
+import urlparse
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+class Instrument(object):
+    """ Receiver of backend requests events. Custom instruments can be added with register_instrument """
+
+    def on_request(self, endpoint, crm, latency, status, response_bytes):
+        pass
+
+    def on_retry(self, endpoint, crm):
+        pass
+
+    def on_reauthentication(self, endpoint, crm):
+        pass
+
+
+class _EndpointStats(object):
+    __slots__ = ('statuses', 'latency_sum', 'buckets', 'response_bytes', 'retries', 'reauthentications')
+
+    def __init__(self, buckets_count):
+        self.statuses = collections.Counter()
+        self.latency_sum = 0.0
+        self.buckets = [0] * buckets_count
+        self.response_bytes = 0
+        self.retries = 0
+        self.reauthentications = 0
+
+    @property
+    def count(self):
+        return sum(self.statuses.values())
+
+
+class MetricsRegistry(Instrument):
+    """ In-process registry of requests metrics per endpoint and CRM.
+
+    Metrics can be exported in Prometheus text format. Each process has its own registry,
+    so API and Celery worker processes export metrics of their own requests.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    PREFIX = 'nodeconductor_sugarcrm_backend'
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, endpoint, crm):
+        key = (endpoint, crm)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _EndpointStats(len(self.BUCKETS))
+        return stats
+
+    def on_request(self, endpoint, crm, latency, status, response_bytes):
+        bucket = bisect.bisect_left(self.BUCKETS, latency)
+        with self._lock:
+            stats = self._get_stats(endpoint, crm)
+            stats.statuses[status] += 1
+            stats.latency_sum += latency
+            stats.response_bytes += response_bytes
+            if bucket < len(self.BUCKETS):
+                stats.buckets[bucket] += 1
+
+    def on_retry(self, endpoint, crm):
+        with self._lock:
+            self._get_stats(endpoint, crm).retries += 1
+
+    def on_reauthentication(self, endpoint, crm):
+        with self._lock:
+            self._get_stats(endpoint, crm).reauthentications += 1
+
+    def snapshot(self):
+        """ Return totals per endpoint and CRM as dictionary """
+        with self._lock:
+            return {key: {
+                'requests': stats.count,
+                'errors': sum(count for status, count in stats.statuses.items()
+                              if not isinstance(status, int) or status >= 400),
+                'latency': stats.latency_sum,
+                'response_bytes': stats.response_bytes,
+                'retries': stats.retries,
+                'reauthentications': stats.reauthentications,
+            } for key, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def export(self):
+        """ Export metrics in Prometheus text format """
+        with self._lock:
+            items = sorted(self._stats.items())
+            lines = []
+
+            def add_metric(name, metric_type, help_text, values):
+                lines.append('# HELP %s_%s %s' % (self.PREFIX, name, help_text))
+                lines.append('# TYPE %s_%s %s' % (self.PREFIX, name, metric_type))
+                for suffix, labels, value in values:
+                    lines.append('%s_%s%s{%s} %s' % (self.PREFIX, name, suffix, _format_labels(labels), value))
+
+            add_metric('requests_total', 'counter', 'Number of requests.', [
+                ('', [('endpoint', endpoint), ('crm', crm), ('status', status)], count)
+                for (endpoint, crm), stats in items for status, count in sorted(stats.statuses.items())])
+
+            histogram_values = []
+            for (endpoint, crm), stats in items:
+                labels = [('endpoint', endpoint), ('crm', crm)]
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, stats.buckets):
+                    cumulative += count
+                    histogram_values.append(('_bucket', labels + [('le', bound)], cumulative))
+                histogram_values.append(('_bucket', labels + [('le', '+Inf')], stats.count))
+                histogram_values.append(('_sum', labels, repr(stats.latency_sum)))
+                histogram_values.append(('_count', labels, stats.count))
+            add_metric('request_duration_seconds', 'histogram', 'Duration of requests.', histogram_values)
+
+            for name, attribute, help_text in (
+                    ('response_bytes_total', 'response_bytes', 'Size of responses content.'),
+                    ('retries_total', 'retries', 'Number of repeated requests.'),
+                    ('reauthentications_total', 'reauthentications', 'Number of authentications.')):
+                add_metric(name, 'counter', help_text, [
+                    ('', [('endpoint', endpoint), ('crm', crm)], getattr(stats, attribute))
+                    for (endpoint, crm), stats in items])
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    def escape(value):
+        return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join('%s="%s"' % (name, escape(value)) for name, value in labels)
+
+
+registry = MetricsRegistry()
+_instruments = [registry]
+
+
+def register_instrument(instrument):
+    """ Add instrument that receives all backend requests events """
+    _instruments.append(instrument)
+
+
+_ID_REGEX = re.compile(r'/[0-9a-fA-F-]{32,36}(?=/|$)')
+
+
+def get_endpoint_name(service, method, url):
+    """ Get name of HTTP endpoint without host and ids, so metrics are not split by them """
+    return '%s %s %s' % (service, method.upper(), _ID_REGEX.sub('/{id}', urlparse.urlparse(url).path))
+
+
+def measure_request(endpoint, crm, send):
+    """ Execute send() and record its latency, response status and size """
+    start = time.time()
+    try:
+        response = send()
+    except requests.exceptions.RequestException:
+        _notify('on_request', endpoint, crm, time.time() - start, 'error', 0)
+        raise
+    _notify('on_request', endpoint, crm, time.time() - start, response.status_code, len(response.content))
+    return response
+
+
+def record_retry(endpoint, crm):
+    _notify('on_retry', endpoint, crm)
+
+
+def record_reauthentication(endpoint, crm):
+    _notify('on_reauthentication', endpoint, crm)
+
+
+def _notify(event, *args):
+    for instrument in _instruments:
+        try:
+            getattr(instrument, event)(*args)
+        except Exception as e:
+            logger.warning('Instrument %s failed to process %s event. Error: %s', instrument, event, e)
+
+
+def log_requests_summary(func):
+    """ Log summary of backend requests that were made during task execution.
+
+    Summary is calculated as difference of registry totals, so it is exact for workers
+    that execute one task at a time.
+    """
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        before = registry.snapshot()
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            summary = _get_summary(before, registry.snapshot())
+            if summary:
+                logger.info('Backend requests of %s(%s) in %.3f s: %s', func.__name__,
+                            ', '.join(repr(arg) for arg in args), time.time() - start, summary)
+    return wrapped
+
+
+def _get_summary(before, after):
+    parts = []
+    for (endpoint, crm), totals in sorted(after.items()):
+        previous = before.get((endpoint, crm), {})
+        diff = {name: value - previous.get(name, 0) for name, value in totals.items()}
+        if not diff['requests'] and not diff['reauthentications']:
+            continue
+        part = '%s [%s] %s requests, %.3f s, %s bytes' % (
+            endpoint, crm or '-', diff['requests'], diff['latency'], diff['response_bytes'])
+        for name in ('errors', 'retries', 'reauthentications'):
+            if diff[name]:
+                part += ', %s %s' % (diff[name], name)
+        parts.append(part)
+    return '; '.join(parts)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodeconductor_sugarcrm', '0013_remove_payable_mixin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crm',
+            name='users_synced_until',
+            field=models.CharField(help_text='Modification time of the latest CRM user that was pulled from SugarCRM.', max_length=20, blank=True),
+        ),
+        migrations.AddField(
+            model_name='crm',
+            name='users_synced_at',
+            field=models.DateTimeField(help_text='Time of the latest successful pull of CRM users from SugarCRM.', null=True, blank=True),
+        ),
+        migrations.CreateModel(
+            name='CRMUser',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('backend_id', models.CharField(max_length=36)),
+                ('user_name', models.CharField(max_length=60)),
+                ('status', models.CharField(max_length=30, blank=True)),
+                ('first_name', models.CharField(max_length=255, blank=True)),
+                ('last_name', models.CharField(max_length=255, blank=True)),
+                ('email1', models.CharField(max_length=255, blank=True)),
+                ('phone_mobile', models.CharField(max_length=50, blank=True)),
+                ('crm', models.ForeignKey(related_name='users', to='nodeconductor_sugarcrm.CRM')),
+            ],
+            options={
+                'verbose_name': 'CRM user',
+                'verbose_name_plural': 'CRM users',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='crmuser',
+            unique_together=set([('crm', 'backend_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='crmuser',
+            index_together=set([('crm', 'user_name'), ('crm', 'status')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodeconductor_sugarcrm', '0014_crm_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crm',
+            name='sla_synced_period',
+            field=models.CharField(help_text='The latest SLA period that was copied from CRMs instance.', max_length=10, blank=True),
+        ),
+        migrations.AddField(
+            model_name='crm',
+            name='sla_synced_timestamp',
+            field=models.IntegerField(help_text='Timestamp of the latest state transition that was copied from CRMs instance.', null=True, blank=True),
+        ),
+    ]
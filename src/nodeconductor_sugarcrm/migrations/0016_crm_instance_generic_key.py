@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('nodeconductor_sugarcrm', '0015_crm_sla_watermarks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crm',
+            name='instance_content_type',
+            field=models.ForeignKey(related_name='+', blank=True, to='contenttypes.ContentType', null=True),
+        ),
+        migrations.AddField(
+            model_name='crm',
+            name='instance_object_id',
+            field=models.PositiveIntegerField(null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodeconductor_sugarcrm', '0016_crm_instance_generic_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotasSync',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('crms_count', models.PositiveIntegerField(default=0)),
+                ('succeeded_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-created',),
+                'verbose_name': 'Quotas synchronization',
+                'verbose_name_plural': 'Quotas synchronizations',
+            },
+        ),
+        migrations.CreateModel(
+            name='QuotasSyncResult',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('user_count', models.IntegerField(null=True, blank=True)),
+                ('latency', models.FloatField(help_text='Synchronization duration in seconds.', null=True, blank=True)),
+                ('error_message', models.TextField(blank=True)),
+                ('crm', models.ForeignKey(related_name='+', to='nodeconductor_sugarcrm.CRM')),
+                ('quotas_sync', models.ForeignKey(related_name='results', to='nodeconductor_sugarcrm.QuotasSync')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotassyncresult',
+            unique_together=set([('quotas_sync', 'crm')]),
+        ),
+    ]
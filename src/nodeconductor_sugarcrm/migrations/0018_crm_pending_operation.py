@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodeconductor_sugarcrm', '0017_quotas_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crm',
+            name='pending_operation',
+            field=models.CharField(help_text='Operation that waits for CRMs instance state change.', max_length=30, blank=True),
+        ),
+    ]
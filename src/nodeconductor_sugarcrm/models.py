@@ -1,6 +1,13 @@
 from __future__ import unicode_literals
 
+import collections
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import resolve, Resolver404
 from django.db import models
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
 
 from nodeconductor.core import utils as core_utils
 from nodeconductor.quotas.fields import QuotaField, LimitAggregatorQuotaField, CounterQuotaField
@@ -54,10 +61,29 @@ class CRM(QuotaModelMixin, structure_models.PublishableResource, structure_model
     admin_username = models.CharField(max_length=60)
     admin_password = models.CharField(max_length=255)
     instance_url = models.URLField(blank=True, help_text='CRMs OpenStack instance URL in NC.')
+    # instance that is resolved from instance URL
+    instance_content_type = models.ForeignKey(ContentType, null=True, blank=True, related_name='+')
+    instance_object_id = models.PositiveIntegerField(null=True, blank=True)
+    instance = GenericForeignKey('instance_content_type', 'instance_object_id')
+    users_synced_until = models.CharField(
+        max_length=20, blank=True, help_text='Modification time of the latest CRM user that was pulled from SugarCRM.')
+    users_synced_at = models.DateTimeField(
+        null=True, blank=True, help_text='Time of the latest successful pull of CRM users from SugarCRM.')
+    sla_synced_period = models.CharField(
+        max_length=10, blank=True, help_text='The latest SLA period that was copied from CRMs instance.')
+    sla_synced_timestamp = models.IntegerField(
+        null=True, blank=True, help_text='Timestamp of the latest state transition that was copied from CRMs instance.')
+    pending_operation = models.CharField(
+        max_length=30, blank=True, help_text='Operation that waits for CRMs instance state change.')
 
     class Quotas(QuotaModelMixin.Quotas):
         user_count = QuotaField(default_limit=0)
 
+    class PendingOperations(object):
+        PROVISION = 'provision'
+        STOP_AND_DESTROY = 'stop_and_destroy'
+        FORCE_STOP_AND_DESTROY = 'force_stop_and_destroy'
+
     class Meta:
         verbose_name = 'CRM'
         verbose_name_plural = 'CRMs'
@@ -75,8 +101,52 @@ class CRM(QuotaModelMixin, structure_models.PublishableResource, structure_model
         return SugarCRMBackend(settings=self.service_project_link.service.settings, crm=self)
 
     def get_instance(self):
-        """ Restore instance from URL """
-        return core_utils.instance_from_url(self.instance_url)
+        """ Get instance by stored content type and object id, restore it from URL if they are not stored yet """
+        if self.instance_content_type_id is not None:
+            instance = self.instance
+            if instance is not None:
+                return instance
+        instance = core_utils.instance_from_url(self.instance_url)
+        self.set_instance(instance)
+        return instance
+
+    def set_instance(self, instance):
+        """ Store content type and object id of resolved instance """
+        self.instance = instance
+        type(self).objects.filter(pk=self.pk).update(
+            instance_content_type=self.instance_content_type, instance_object_id=self.instance_object_id)
+
+    @classmethod
+    def get_instances(cls, crms):
+        """ Get instances of several CRMs with one query per instance model.
+
+        Instances that are not stored yet are restored from URLs and stored.
+        Returns dictionary with CRMs as keys and instances as values, CRMs without instances are skipped.
+        """
+        stored_crms = collections.defaultdict(dict)
+        resolved_crms = collections.defaultdict(dict)
+        for crm in crms:
+            if crm.instance_content_type_id is not None:
+                stored_crms[crm.instance_content_type_id][crm.instance_object_id] = crm
+                continue
+            try:
+                match = resolve(core_utils.clear_url(crm.instance_url))
+            except Resolver404:
+                continue
+            model = core_utils.get_model_from_resolve_match(match)
+            resolved_crms[model][match.kwargs['uuid'].replace('-', '')] = crm
+
+        instances = {}
+        for content_type_id, crms_by_pk in stored_crms.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for instance in model.objects.filter(pk__in=crms_by_pk.keys()):
+                instances[crms_by_pk[instance.pk]] = instance
+        for model, crms_by_uuid in resolved_crms.items():
+            for instance in model.objects.filter(uuid__in=crms_by_uuid.keys()):
+                crm = crms_by_uuid[instance.uuid.hex]
+                crm.set_instance(instance)
+                instances[crm] = instance
+        return instances
 
     def as_dict(self):
         """ Represent instance as dict with all necessary attributes """
@@ -88,3 +158,77 @@ class CRM(QuotaModelMixin, structure_models.PublishableResource, structure_model
             'admin_password': self.admin_password,
             'tags': [tag.name for tag in self.tags.all()],
         }
+
+
+@python_2_unicode_compatible
+class CRMUser(models.Model):
+    """ Local copy of SugarCRM user.
+
+    SugarCRM user id is stored as backend_id, it is unique only within CRM.
+    Users are pulled from SugarCRM by backend.
+    """
+    crm = models.ForeignKey(CRM, related_name='users')
+    backend_id = models.CharField(max_length=36)
+    user_name = models.CharField(max_length=60)
+    status = models.CharField(max_length=30, blank=True)
+    first_name = models.CharField(max_length=255, blank=True)
+    last_name = models.CharField(max_length=255, blank=True)
+    email1 = models.CharField(max_length=255, blank=True)
+    phone_mobile = models.CharField(max_length=50, blank=True)
+
+    MIRRORED_FIELDS = ('user_name', 'status', 'first_name', 'last_name', 'email1', 'phone_mobile')
+
+    class Meta:
+        verbose_name = 'CRM user'
+        verbose_name_plural = 'CRM users'
+        unique_together = ('crm', 'backend_id')
+        index_together = (('crm', 'user_name'), ('crm', 'status'))
+
+    def __str__(self):
+        return self.user_name
+
+    @classmethod
+    def get_mirrored_values(cls, user):
+        """ Get values of mirrored fields from SugarCRM user """
+        return {field: getattr(user, field, None) or '' for field in cls.MIRRORED_FIELDS}
+
+
+@python_2_unicode_compatible
+class QuotasSync(models.Model):
+    """ Summary of CRMs quotas synchronization that is executed in fan-out mode """
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    crms_count = models.PositiveIntegerField(default=0)
+    succeeded_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Quotas synchronization'
+        verbose_name_plural = 'Quotas synchronizations'
+        ordering = ('-created',)
+
+    def __str__(self):
+        return 'Quotas synchronization %s' % self.created
+
+    def aggregate_results(self):
+        """ Count results and mark synchronization as finished """
+        self.succeeded_count = self.results.filter(error_message='').count()
+        self.failed_count = self.results.exclude(error_message='').count()
+        self.finished = timezone.now()
+        self.save()
+
+
+@python_2_unicode_compatible
+class QuotasSyncResult(models.Model):
+    """ Outcome of quotas synchronization of one CRM """
+    quotas_sync = models.ForeignKey(QuotasSync, related_name='results')
+    crm = models.ForeignKey(CRM, related_name='+')
+    user_count = models.IntegerField(null=True, blank=True)
+    latency = models.FloatField(null=True, blank=True, help_text='Synchronization duration in seconds.')
+    error_message = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('quotas_sync', 'crm')
+
+    def __str__(self):
+        return '%s: %s' % (self.crm, self.error_message or self.user_count)
@@ -1,4 +1,5 @@
 import re
+from collections import OrderedDict
 
 from rest_framework import serializers
 from rest_framework.reverse import reverse
@@ -7,7 +8,7 @@ from nodeconductor.core import serializers as core_serializers
 from nodeconductor.quotas import serializers as quotas_serializers
 from nodeconductor.structure import serializers as structure_serializers
 
-from . import models
+from . import backend, models, utils
 
 
 class ServiceSerializer(structure_serializers.BaseServiceSerializer):
@@ -26,6 +27,9 @@ class ServiceSerializer(structure_serializers.BaseServiceSerializer):
         'phone_regex': 'RegEx for phone validation',
         'sms_email_from': 'Name of SMS email sender',
         'sms_email_rcpt': 'Name of SMS email recipient',
+        'users_page_size': 'Number of CRM users that are fetched from SugarCRM API by one request',
+        'users_fetch_parallelism': 'Maximal number of concurrent requests for fetching CRM users pages',
+        'quotas_sync_concurrency': 'Maximal number of CRMs that are synchronized concurrently by quotas sync task',
     }
 
     class Meta(structure_serializers.BaseServiceSerializer.Meta):
@@ -93,8 +97,10 @@ class CRMSerializer(structure_serializers.PublishableResourceSerializer):
 class CRMUserSerializer(core_serializers.AugmentedSerializerMixin, serializers.Serializer):
 
     url = serializers.SerializerMethodField()
-    uuid = serializers.CharField(read_only=True, source='id')
-    user_name = serializers.CharField(max_length=60)
+    uuid = serializers.SerializerMethodField()
+    user_name = serializers.RegexField(
+        re.compile(r'^[\w.@+-]+$', re.UNICODE), max_length=60,
+        error_messages={'invalid': 'User name can contain only letters, digits and characters ".@+-_".'})
     status = serializers.CharField(max_length=30, required=False)
     last_name = serializers.CharField(max_length=30)
     first_name = serializers.CharField(max_length=30, required=False)
@@ -111,24 +117,54 @@ class CRMUserSerializer(core_serializers.AugmentedSerializerMixin, serializers.S
         if self.instance is not None:
             for field in fields.values():
                 field.required = False
+        # render only requested fields if at least one of them exists
+        requested_fields = [name for name in self.context.get('fields', ()) if name in fields]
+        if requested_fields:
+            fields = OrderedDict((name, field) for name, field in fields.items() if name in requested_fields)
         return fields
 
+    @classmethod
+    def get_source_fields(cls, fields):
+        """ Get names of SugarCRM users fields that are needed to render given serializer fields.
+
+        Empty tuple is returned if none of fields exists - all fields are rendered in this case.
+        """
+        sources = set()
+        for name in fields:
+            field = cls._declared_fields.get(name)
+            if field is None or field.write_only:
+                continue
+            # url and uuid are built from user id
+            sources.add('id' if name in ('url', 'uuid') else field.source or name)
+        return tuple(sorted(sources))
+
+    def _get_user_id(self, obj):
+        # local copies store SugarCRM user id as backend_id
+        return obj.backend_id if isinstance(obj, models.CRMUser) else obj.id
+
+    def get_uuid(self, obj):
+        return self._get_user_id(obj)
+
     def get_url(self, obj):
         crm = self.context['crm']
         request = self.context['request']
-        return reverse('sugarcrm-users-detail', kwargs={'crm_uuid': crm.uuid.hex, 'pk': obj.id}, request=request)
+        return reverse('sugarcrm-users-detail', kwargs={'crm_uuid': crm.uuid.hex, 'pk': self._get_user_id(obj)},
+                       request=request)
 
     def validate_user_name(self, value):
+        # names of bulk created users are checked together by view
+        if self.context.get('bulk'):
+            return value
         crm = self.context['crm']
-        users = crm.get_backend().list_users()
-        exist_user_names = [u.user_name for u in users]
-        if value in exist_user_names:
+        if crm.get_backend().user_name_exists(value):
             raise serializers.ValidationError('User with such name already exists.')
         return value
 
     def validate(self, attrs):
         attrs = super(CRMUserSerializer, self).validate(attrs)
-        if not self.instance:
+        # quota is checked once for all users on bulk creation.
+        # Quota usage is a local counter of active users, so check does not request SugarCRM
+        if not self.instance and not self.context.get('bulk'):
             crm = self.context['crm']
             user_count_quota = crm.quotas.get(name=crm.Quotas.user_count)
             if user_count_quota.is_exceeded(delta=1):
@@ -139,9 +175,8 @@ class CRMUserSerializer(core_serializers.AugmentedSerializerMixin, serializers.S
         crm = self.context['crm']
         phone = attrs.get('phone_mobile')
         if phone:
-            settings = crm.service_project_link.service.settings
-            phone_regex = settings.get_option('phone_regex')
-            if phone_regex and not re.search(phone_regex, phone):
+            phone_regex = utils.get_crm_options(crm).phone_regex
+            if phone_regex and not phone_regex.search(phone):
                 raise serializers.ValidationError({'phone': "Invalid phone number."})
 
         if attrs.get('notify', False) and not phone:
@@ -150,6 +185,34 @@ class CRMUserSerializer(core_serializers.AugmentedSerializerMixin, serializers.S
         return attrs
 
 
+class CRMUsersFilterSerializer(serializers.Serializer):
+    """ Filters of CRM users list, in ?fresh=1 mode their values are used in SugarCRM queries """
+    STATUSES = backend.SugarCRMBackend.SugarCRMClient.UserStatuses
+
+    user_name = serializers.CharField(max_length=60, required=False, allow_blank=True)
+    first_name = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    status = serializers.ChoiceField(choices=(STATUSES.ACTIVE, STATUSES.INACTIVE, STATUSES.RESERVED), required=False)
+
+
+class CRMUsersBulkSerializer(serializers.Serializer):
+    OPERATIONS_LIMIT = 500
+
+    create = serializers.ListField(child=serializers.DictField(), required=False)
+    update = serializers.ListField(child=serializers.DictField(), required=False)
+    deactivate = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate(self, attrs):
+        operations_count = sum(len(attrs.get(operation, [])) for operation in ('create', 'update', 'deactivate'))
+        if not operations_count:
+            raise serializers.ValidationError('At least one operation should be defined.')
+        if operations_count > self.OPERATIONS_LIMIT:
+            raise serializers.ValidationError(
+                'Too many operations (operations count: %s, max operations count: %s).' %
+                (operations_count, self.OPERATIONS_LIMIT))
+        return attrs
+
+
 class UserPasswordSerializer(serializers.Serializer):
     notify = serializers.BooleanField(required=False)
 
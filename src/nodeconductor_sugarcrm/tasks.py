@@ -1,21 +1,66 @@
+import collections
+import datetime
+import functools
 import logging
 import sys
+import time
 
-from celery import shared_task, chain
+from celery import shared_task, chain, chord, current_task
+from celery.exceptions import MaxRetriesExceededError
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.urlresolvers import Resolver404
 from django.utils import six, timezone
 
 from nodeconductor.core import utils as core_utils
 from nodeconductor.core.tasks import save_error_message, transition, retry_if_false, BackendMethodTask
 
-from .backend import SugarCRMBackendError
-from .models import CRM
+from .backend import SugarCRMBackend, SugarCRMBackendError
+from .circuit_breaker import circuit_breaker
+from .engine import BatchEngine
+from .metrics import log_requests_summary
+from .models import CRM, QuotasSync, QuotasSyncResult
+from .utils import get_options, get_plugin_setting
 
 
 logger = logging.getLogger(__name__)
 
+MIN_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 120
+PULL_SLA_CHUNK_SIZE = 200
+
+
+def retry_if_false_with_backoff(func):
+    """ Retry task while it returns False. Delay between retries grows exponentially up to MAX_RETRY_DELAY """
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        is_true = func(*args, **kwargs)
+        if not is_true:
+            countdown = min(MIN_RETRY_DELAY * 2 ** current_task.request.retries, MAX_RETRY_DELAY)
+            try:
+                current_task.retry(countdown=countdown)
+            except MaxRetriesExceededError:
+                raise RuntimeError('Task %s failed to retry' % current_task.name)
+        return is_true
+    return wrapped
+
+
+def are_instance_states_tracked():
+    """ Check if CRMs instances states changes are tracked by web hook receiver or batch poller.
+
+    In this case CRM operations do not poll instances states themselves and wait for continuation.
+    """
+    return bool(get_plugin_setting('INSTANCE_EVENTS_TOKEN') or get_plugin_setting('BATCH_INSTANCES_POLLING'))
+
 
 @shared_task(name='nodeconductor.sugarcrm.provision_crm')
 def provision_crm(crm_uuid):
+    if are_instance_states_tracked():
+        schedule_crm_instance_provision.si(crm_uuid).apply_async(
+            link=wait_for_crm_instance_event.si(crm_uuid, CRM.PendingOperations.PROVISION),
+            link_error=set_erred.si(crm_uuid),
+        )
+        return
+
     chain(
         schedule_crm_instance_provision.si(crm_uuid),
         wait_for_crm_template_group_provision.si(crm_uuid),
@@ -33,6 +78,14 @@ def stop_and_destroy_crm(crm_uuid, force=False):
         error_callback = set_erred.si(crm_uuid)
     else:
         error_callback = force_delete.si(crm_uuid)
+
+    if are_instance_states_tracked():
+        schedule_crm_instance_stopping.si(crm_uuid).apply_async(
+            link=wait_for_crm_instance_event.si(crm_uuid, CRM.PendingOperations.STOP_AND_DESTROY, force=force),
+            link_error=error_callback,
+        )
+        return
+
     chain(
         schedule_crm_instance_stopping.si(crm_uuid),
         wait_for_crm_instance_state.si(crm_uuid, state='Offline'),
@@ -45,9 +98,62 @@ def stop_and_destroy_crm(crm_uuid, force=False):
     )
 
 
+@shared_task
+def wait_for_crm_instance_event(crm_uuid, operation, force=False):
+    """ Store CRM operation as pending until its instance event is received or batch poller detects change.
+
+    Pending operation is stored in CRM row, so it is not lost on cache eviction or restart.
+    If operation is not continued during INSTANCE_EVENTS_TIMEOUT seconds -
+    it is continued anyway and instance state is polled.
+    """
+    timeout = get_plugin_setting('INSTANCE_EVENTS_TIMEOUT', 10 * 60)
+    if operation == CRM.PendingOperations.STOP_AND_DESTROY and force:
+        operation = CRM.PendingOperations.FORCE_STOP_AND_DESTROY
+    CRM.objects.filter(uuid=crm_uuid).update(pending_operation=operation)
+    continue_crm_operation.apply_async(args=(crm_uuid,), countdown=timeout)
+
+
+@shared_task(name='nodeconductor.sugarcrm.continue_crm_operation')
+def continue_crm_operation(crm_uuid):
+    """ Continue CRM pending operation on instance state change or on timeout """
+    crms = CRM.objects.filter(
+        uuid=crm_uuid, state__in=[CRM.States.PROVISIONING, CRM.States.STOPPING]).exclude(pending_operation='')
+    pending_operation = crms.values_list('pending_operation', flat=True).first()
+    if pending_operation is None:
+        return
+    # operation should be continued only once - on state change or on timeout
+    if not crms.filter(pending_operation=pending_operation).update(pending_operation=''):
+        return
+
+    if pending_operation == CRM.PendingOperations.PROVISION:
+        chain(
+            wait_for_crm_template_group_provision.si(crm_uuid),
+            init_crm_api_url.si(crm_uuid),
+            init_crm_quotas.si(crm_uuid),
+        ).apply_async(
+            link=set_online.si(crm_uuid),
+            link_error=set_erred.si(crm_uuid)
+        )
+    elif pending_operation in (CRM.PendingOperations.STOP_AND_DESTROY, CRM.PendingOperations.FORCE_STOP_AND_DESTROY):
+        if pending_operation == CRM.PendingOperations.STOP_AND_DESTROY:
+            error_callback = set_erred.si(crm_uuid)
+        else:
+            error_callback = force_delete.si(crm_uuid)
+        chain(
+            wait_for_crm_instance_state.si(crm_uuid, state='Offline'),
+            set_offline.si(crm_uuid),
+            schedule_deletion.si(crm_uuid),
+            schedule_crm_instance_deletion.si(crm_uuid),
+        ).apply_async(
+            link=delete.si(crm_uuid),
+            link_error=error_callback,
+        )
+
+
 @shared_task
 @transition(CRM, 'begin_provisioning')
 @save_error_message
+@log_requests_summary
 def schedule_crm_instance_provision(crm_uuid, transition_entity=None):
     crm = transition_entity
     backend = crm.get_backend()
@@ -57,6 +163,7 @@ def schedule_crm_instance_provision(crm_uuid, transition_entity=None):
 @shared_task
 @transition(CRM, 'begin_stopping')
 @save_error_message
+@log_requests_summary
 def schedule_crm_instance_stopping(crm_uuid, transition_entity=None):
     crm = transition_entity
     backend = crm.get_backend()
@@ -66,14 +173,16 @@ def schedule_crm_instance_stopping(crm_uuid, transition_entity=None):
 @shared_task
 @transition(CRM, 'begin_deleting')
 @save_error_message
+@log_requests_summary
 def schedule_crm_instance_deletion(crm_uuid, transition_entity=None):
     crm = transition_entity
     backend = crm.get_backend()
     backend.schedule_crm_instance_deletion(crm)
 
 
-@shared_task(max_retries=120, default_retry_delay=20)
-@retry_if_false
+@shared_task(max_retries=30)
+@retry_if_false_with_backoff
+@log_requests_summary
 def wait_for_crm_instance_state(crm_uuid, state, erred_state='Erred'):
     crm = CRM.objects.get(uuid=crm_uuid)
     backend = crm.get_backend()
@@ -90,8 +199,9 @@ def wait_for_crm_instance_state(crm_uuid, state, erred_state='Erred'):
     return current_state == state
 
 
-@shared_task(max_retries=120, default_retry_delay=20)
-@retry_if_false
+@shared_task(max_retries=30)
+@retry_if_false_with_backoff
+@log_requests_summary
 def wait_for_crm_template_group_provision(crm_uuid):
     crm = CRM.objects.get(uuid=crm_uuid)
     backend = crm.get_backend()
@@ -108,6 +218,7 @@ def wait_for_crm_template_group_provision(crm_uuid):
 
 
 @shared_task
+@log_requests_summary
 def init_crm_api_url(crm_uuid):
     """ Init CRM API URL """
     crm = CRM.objects.get(uuid=crm_uuid)
@@ -118,15 +229,22 @@ def init_crm_api_url(crm_uuid):
         raise SugarCRMBackendError(
             'Cannot use OpenStack instance with name "%s" for CRM - it does not have external IP.' % crm.name)
     crm.api_url = '{protocol}://{external_ip}'.format(
-        protocol=settings.get_option('protocol'),
+        protocol=get_options(settings)['protocol'],
         external_ip=external_ips[0])
     # we consider CRM as activated at this point
     crm.start_time = timezone.now()
     crm.save()
+    # store resolved instance to avoid its resolving from URL later
+    try:
+        crm.get_instance()
+    except (Resolver404, ObjectDoesNotExist) as e:
+        logger.warning('Cannot resolve instance of CRM "%s" (UUID: %s), it will be resolved later. Error: %s',
+                       crm.name, crm.uuid.hex, e)
 
 
 @shared_task(max_retries=30, default_retry_delay=10)
 @retry_if_false
+@log_requests_summary
 def init_crm_quotas(crm_uuid):
     """ Init CRM quotas """
     crm = CRM.objects.get(uuid=crm_uuid)
@@ -170,6 +288,7 @@ def delete(crm_uuid):
 
 
 @shared_task
+@log_requests_summary
 def force_delete(crm_uuid):
     """ Schedule corresponding OpenStack instance deletion """
     crm = CRM.objects.get(uuid=crm_uuid)
@@ -184,22 +303,143 @@ def force_delete(crm_uuid):
 
 # celerybeat tasks:
 
+@shared_task(name='nodeconductor.sugarcrm.poll_crms_instances')
+@log_requests_summary
+def poll_crms_instances():
+    """ Check instances states of all CRMs with pending operations and continue operations of ready ones """
+    if not get_plugin_setting('BATCH_INSTANCES_POLLING'):
+        return
+
+    ready_states = {
+        CRM.States.PROVISIONING: ('Online', 'Erred'),
+        CRM.States.STOPPING: ('Offline', 'Erred'),
+    }
+    pending_crms = (CRM.objects.filter(state__in=ready_states.keys()).exclude(pending_operation='')
+                    .select_related('service_project_link__service__settings'))
+    # instances of different service settings are fetched concurrently
+    for crm, outcome in BatchEngine().get_crms_instances_details(pending_crms).items():
+        if outcome.error is not None:
+            logger.warning('Cannot get instance details for CRM "%s". Error: %s', crm.name, outcome.error)
+            continue
+        if outcome.result.get('state') in ready_states[crm.state]:
+            continue_crm_operation.delay(crm.uuid.hex)
+
+
+@shared_task(name='nodeconductor.sugarcrm.probe_crms_circuits')
+def probe_crms_circuits():
+    """ Probe hosts of online CRMs with half-open circuits, so circuits are closed for reachable hosts """
+    crms = [crm for crm in CRM.objects.filter(state=CRM.States.ONLINE).select_related(
+            'service_project_link__service__settings')
+            if crm.api_url and circuit_breaker.get_state(crm.api_url) == circuit_breaker.States.HALF_OPEN]
+    for crm, outcome in BatchEngine().count_crms_users(crms).items():
+        if outcome.error is None:
+            logger.info('Host of CRM "%s" is reachable again.', crm.name)
+
+
 @shared_task(name='nodeconductor.sugarcrm.sync_crms_quotas')
 def sync_crms_quotas():
-    """ Update quota usage from backend for all CRMs """
-    for crm in CRM.objects.filter(state=CRM.States.ONLINE):
-        sync_crm_quotas.delay(crm.uuid.hex)
+    """ Update quota usage from backend for all CRMs
+
+    If NODECONDUCTOR_SUGARCRM['QUOTAS_SYNC_FAN_OUT'] is True - CRMs of each service settings
+    are synchronized by "quotas_sync_concurrency" sequential chains of tasks and outcomes are
+    stored as QuotasSync summary.
+    """
+    crms = CRM.objects.filter(state=CRM.States.ONLINE)
+    if not get_plugin_setting('QUOTAS_SYNC_FAN_OUT'):
+        for crm in crms:
+            sync_crm_quotas.delay(crm.uuid.hex)
+        return
+
+    crms_by_settings = collections.defaultdict(list)
+    for crm in crms.select_related('service_project_link__service__settings'):
+        crms_by_settings[crm.service_project_link.service.settings].append(crm.uuid.hex)
+    if not crms_by_settings:
+        return
+
+    quotas_sync = QuotasSync.objects.create(crms_count=sum(len(uuids) for uuids in crms_by_settings.values()))
+    lanes = []
+    for settings, crms_uuids in crms_by_settings.items():
+        concurrency = max(int(get_options(settings)['quotas_sync_concurrency']), 1)
+        for lane_index in range(min(concurrency, len(crms_uuids))):
+            lanes.append(chain(*[sync_crm_quotas_with_result.si(quotas_sync.pk, crm_uuid)
+                                 for crm_uuid in crms_uuids[lane_index::concurrency]]))
+    chord(lanes)(finish_quotas_sync.si(quotas_sync.pk))
+
+
+@shared_task
+@log_requests_summary
+def sync_crm_quotas_with_result(quotas_sync_id, crm_uuid):
+    """ Sync CRM quotas and store outcome. Errors are stored too, so the rest of lane is not interrupted """
+    result = QuotasSyncResult(quotas_sync_id=quotas_sync_id)
+    start = time.time()
+    try:
+        crm = CRM.objects.get(uuid=crm_uuid)
+        result.crm = crm
+        result.user_count = crm.get_backend().sync_user_quota()
+    except Exception as e:
+        logger.warning('Cannot sync quotas of CRM with UUID %s. Error: %s', crm_uuid, e)
+        result.error_message = six.text_type(e) or e.__class__.__name__
+    result.latency = time.time() - start
+    if result.crm_id is not None:
+        result.save()
 
 
 @shared_task
+def finish_quotas_sync(quotas_sync_id):
+    quotas_sync = QuotasSync.objects.get(pk=quotas_sync_id)
+    quotas_sync.aggregate_results()
+    logger.info('Quotas of %s CRMs were synchronized, %s failed.',
+                quotas_sync.succeeded_count, quotas_sync.failed_count)
+    # keep history of synchronizations for limited period
+    history_days = get_plugin_setting('QUOTAS_SYNC_HISTORY_DAYS', 30)
+    QuotasSync.objects.filter(created__lt=timezone.now() - datetime.timedelta(days=history_days)).delete()
+
+
+@shared_task
+@log_requests_summary
 def sync_crm_quotas(crm_uuid):
     crm = CRM.objects.get(uuid=crm_uuid)
     backend = crm.get_backend()
     backend.sync_user_quota()
 
 
-@shared_task(name='nodeconductor.sugarcrm.pull_sla')
-def pull_sla():
-    """ Copy OpenStack instance SLA and events as CRM events """
+@shared_task(name='nodeconductor.sugarcrm.pull_crms_users')
+def pull_crms_users():
+    """ Update local copies of users for all CRMs """
     for crm in CRM.objects.filter(state=CRM.States.ONLINE):
-        BackendMethodTask().delay(core_utils.serialize_instance(crm), 'pull_crm_sla')
+        pull_crm_users.delay(crm.uuid.hex)
+
+
+@shared_task
+@log_requests_summary
+def pull_crm_users(crm_uuid):
+    crm = CRM.objects.get(uuid=crm_uuid)
+    backend = crm.get_backend()
+    backend.pull_users()
+
+
+@shared_task(name='nodeconductor.sugarcrm.pull_sla')
+def pull_sla(full=False):
+    """ Copy OpenStack instance SLA and events as CRM events.
+
+    Only new SLA items and events are copied, all of them are reconciled if <full> is True.
+    SLA of all CRMs is copied by this task with bulk queries, if NODECONDUCTOR_SUGARCRM['PULL_SLA_PER_CRM']
+    is True - separate task is executed for each CRM.
+    """
+    if get_plugin_setting('PULL_SLA_PER_CRM'):
+        for crm in CRM.objects.filter(state=CRM.States.ONLINE):
+            BackendMethodTask().delay(core_utils.serialize_instance(crm), 'pull_crm_sla', full=full)
+        return
+
+    crms = list(CRM.objects.filter(state=CRM.States.ONLINE))
+    for start in range(0, len(crms), PULL_SLA_CHUNK_SIZE):
+        chunk = crms[start:start + PULL_SLA_CHUNK_SIZE]
+        instances = CRM.get_instances(chunk)
+        for crm in chunk:
+            if crm not in instances:
+                crm.error_message = 'Cannot get instance for CRM %s (PK: %s).' % (crm.name, crm.pk)
+                crm.set_erred()
+                crm.save()
+                logger.error(crm.error_message)
+        SugarCRMBackend.copy_crms_sla(instances, full=full)
+        logger.info('Successfully pulled SLA for %s CRMs', len(instances))
@@ -0,0 +1,181 @@
+import uuid
+
+from django.test import TestCase
+import mock
+import sugarcrm
+
+from nodeconductor_sugarcrm import backend
+
+
+class SugarCRMClientQueryTest(TestCase):
+
+    def setUp(self):
+        session_patcher = mock.patch('nodeconductor_sugarcrm.backend.SugarCRMSession')
+        self.addCleanup(session_patcher.stop)
+        session_patcher.start()
+        self.client = backend.SugarCRMBackend.SugarCRMClient('http://crm.example.com', 'admin', 'secret')
+
+    def test_quotes_and_backslashes_are_escaped(self):
+        self.assertEqual(self.client._escape("O'Brien\\"), "O''Brien\\\\")
+
+    def test_users_query_excludes_admins(self):
+        self.assertEqual(self.client._get_users_query(), "users.is_admin = '0'")
+
+    def test_users_query_conditions_are_escaped_and_sorted(self):
+        query = self.client._get_users_query(user_name="o'brien", status='Active')
+
+        self.assertEqual(query, "users.is_admin = '0' AND users.status = 'Active' AND users.user_name = 'o''brien'")
+
+    def test_users_cannot_be_filtered_by_unknown_field(self):
+        self.assertRaises(ValueError, self.client._get_users_query, **{'is_admin': '1'})
+        self.assertRaises(ValueError, self.client._get_users_query, **{"status = '' OR users.id": ''})
+
+    def test_in_condition_values_are_escaped(self):
+        condition = self.client._get_in_condition('user_name', ['alice', "o'brien"])
+
+        self.assertEqual(condition, "users.user_name IN ('alice', 'o''brien')")
+
+    def test_in_condition_field_is_validated(self):
+        self.assertRaises(ValueError, self.client._get_in_condition, 'id', ['1'])
+
+
+class Item(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ItemsQuerySet(list):
+    """ In-memory replacement of model manager that supports lookups of copied items """
+
+    def filter(self, **kwargs):
+        return ItemsQuerySet(item for item in self
+                             if all(self._matches(item, lookup, value) for lookup, value in kwargs.items()))
+
+    def _matches(self, item, lookup, value):
+        field, _, operator = lookup.partition('__')
+        item_value = getattr(item, field)
+        if operator == 'in':
+            return item_value in value
+        if operator == 'gte':
+            return item_value >= value
+        return item_value == value
+
+    def bulk_create(self, items):
+        self.created = list(items)
+
+    def delete(self):
+        pass
+
+
+class CopyCRMsSLATest(TestCase):
+
+    def setUp(self):
+        self.crm_content_type = mock.Mock(id=1)
+        self.instance_content_type = mock.Mock(id=2)
+        self.crm = Item(pk=10, sla_synced_period='2016-03', sla_synced_timestamp=None)
+        self.instance = Item(pk=20)
+
+        self.sla_model = self.mock_model('ResourceSla')
+        self.transition_model = self.mock_model('ResourceSlaStateTransition')
+        crm_model = mock.patch.object(backend.models.CRM, 'objects')
+        self.addCleanup(crm_model.stop)
+        crm_model.start().select_for_update.return_value.filter.return_value = [self.crm]
+        content_types = mock.patch('nodeconductor_sugarcrm.backend.ContentType')
+        self.addCleanup(content_types.stop)
+        content_types.start().objects.get_for_model.side_effect = (
+            lambda obj: self.crm_content_type if obj is backend.models.CRM else self.instance_content_type)
+        update_rows = mock.patch.object(backend.SugarCRMBackend, '_update_rows')
+        self.addCleanup(update_rows.stop)
+        self.update_rows = update_rows.start()
+
+    def mock_model(self, name):
+        model = type(name, (Item,), {'objects': ItemsQuerySet()})
+        patcher = mock.patch.object(backend.monitoring_models, name, model)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def add_sla(self, scope, content_type, period, value, pk=None):
+        self.sla_model.objects.append(Item(
+            pk=pk, content_type=content_type, content_type_id=content_type.id, object_id=scope.pk,
+            period=period, value=value, agreed_value=95))
+
+    def test_yearly_sla_is_compared_with_year_of_watermark(self):
+        for period in ('2015', '2016', '2016-02', '2016-03', '2016-04'):
+            self.add_sla(self.instance, self.instance_content_type, period, 99)
+
+        backend.SugarCRMBackend.copy_crms_sla({self.crm: self.instance})
+
+        # year of watermark and months that are not older than watermark are copied
+        self.assertEqual(sorted(item.period for item in self.sla_model.objects.created),
+                         ['2016', '2016-03', '2016-04'])
+        self.assertEqual(self.crm.sla_synced_period, '2016-04')
+
+    def test_changed_sla_items_and_advanced_watermarks_are_updated(self):
+        self.add_sla(self.instance, self.instance_content_type, '2016', 98)
+        self.add_sla(self.instance, self.instance_content_type, '2016-04', 99)
+        self.add_sla(self.crm, self.crm_content_type, '2016', 99, pk=1)
+
+        backend.SugarCRMBackend.copy_crms_sla({self.crm: self.instance})
+
+        self.assertEqual(self.update_rows.call_args_list, [
+            mock.call(self.sla_model, {1: {'value': 98, 'agreed_value': 95}}),
+            mock.call(self.transition_model, {}),
+            mock.call(backend.models.CRM, {10: {'sla_synced_period': '2016-04', 'sla_synced_timestamp': None}}),
+        ])
+
+    def test_watermarks_are_not_updated_if_items_are_older(self):
+        self.add_sla(self.instance, self.instance_content_type, '2016-02', 99)
+
+        backend.SugarCRMBackend.copy_crms_sla({self.crm: self.instance})
+
+        self.assertEqual(self.sla_model.objects.created, [])
+        self.assertEqual(self.update_rows.call_args, mock.call(backend.models.CRM, {}))
+
+    def test_all_items_are_copied_in_full_mode(self):
+        for period in ('2015', '2016-02'):
+            self.add_sla(self.instance, self.instance_content_type, period, 99)
+
+        backend.SugarCRMBackend.copy_crms_sla({self.crm: self.instance}, full=True)
+
+        self.assertEqual(sorted(item.period for item in self.sla_model.objects.created), ['2015', '2016-02'])
+
+
+class UsersQuotaAccountingTest(TestCase):
+
+    def setUp(self):
+        settings = mock.Mock(backend_url='http://nc.example.com/api/', username='admin', password='secret')
+        crm = mock.Mock(uuid=uuid.uuid4())
+        crm.name = 'CRM'
+        self.backend = backend.SugarCRMBackend(settings, crm=crm)
+        self.backend._sugar_client = mock.Mock()
+        for name in ('_add_user_count', '_save_user_copy'):
+            patcher = mock.patch.object(self.backend, name)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_only_active_created_users_are_counted(self):
+        users_data = [
+            {'user_name': 'alice', 'password': 'secret', 'last_name': 'A', 'status': 'Active'},
+            {'user_name': 'bob', 'password': 'secret', 'last_name': 'B', 'status': 'Inactive'},
+            {'user_name': 'carol', 'password': 'secret', 'last_name': 'C'},
+        ]
+        self.backend.sugar_client.create_users.return_value = [
+            sugarcrm.User(id=str(index), **data) for index, data in enumerate(users_data)]
+
+        self.backend.create_users(users_data)
+
+        self.backend._add_user_count.assert_called_once_with(2)
+
+    def test_quota_is_changed_by_status_changes_of_updated_users(self):
+        updates = [
+            (sugarcrm.User(id='1', user_name='alice', status='Active'), {'status': 'Inactive'}),
+            (sugarcrm.User(id='2', user_name='bob', status='Active'), {'status': 'Inactive'}),
+            (sugarcrm.User(id='3', user_name='carol', status='Inactive'), {'status': 'Active'}),
+            (sugarcrm.User(id='4', user_name='dave', status='Inactive'), {'last_name': 'D'}),
+            (sugarcrm.User(id='5', user_name='eve', status='Active'), {'status': 'Active'}),
+        ]
+
+        self.backend.update_users(updates)
+
+        self.backend._add_user_count.assert_called_once_with(-1)
@@ -0,0 +1,112 @@
+import threading
+
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from nodeconductor_sugarcrm.cache import SingleFlight
+
+
+class Interrupted(BaseException):
+    """ Interruption of call that is not an error, like task time limit """
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 60})
+    def test_result_is_reused_during_ttl(self):
+        func = mock.Mock(return_value={'count': 1})
+
+        first = self.flight.do(('crm', 'count'), func)
+        first['count'] = 2
+        second = self.flight.do(('crm', 'count'), func)
+
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(second, {'count': 1})
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 0})
+    def test_result_is_not_kept_if_ttl_is_zero(self):
+        func = mock.Mock(return_value=1)
+
+        self.flight.do(('crm', 'count'), func)
+        self.flight.do(('crm', 'count'), func)
+
+        self.assertEqual(func.call_count, 2)
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 60})
+    def test_error_is_not_kept(self):
+        func = mock.Mock(side_effect=[ValueError('error'), 1])
+
+        self.assertRaises(ValueError, self.flight.do, ('crm', 'count'), func)
+        self.assertEqual(self.flight.do(('crm', 'count'), func), 1)
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 60})
+    def test_forget_removes_results_of_group_only(self):
+        self.flight.do(('crm1', 'count'), lambda: 1)
+        self.flight.do(('crm2', 'count'), lambda: 2)
+
+        self.flight.forget('crm1')
+
+        self.assertEqual(self.flight.do(('crm1', 'count'), lambda: 3), 3)
+        self.assertEqual(self.flight.do(('crm2', 'count'), lambda: 4), 2)
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 60})
+    def test_concurrent_call_waits_for_leader_result(self):
+        started, release = threading.Event(), threading.Event()
+        func_calls = []
+
+        def leader_func():
+            func_calls.append('leader')
+            started.set()
+            release.wait()
+            return 'result'
+
+        def follower_func():
+            func_calls.append('follower')
+            return 'follower result'
+
+        results = {}
+        leader = threading.Thread(target=lambda: results.update(leader=self.flight.do('key', leader_func)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.update(follower=self.flight.do('key', follower_func)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(func_calls, ['leader'])
+        self.assertEqual(results, {'leader': 'result', 'follower': 'result'})
+
+    @override_settings(NODECONDUCTOR_SUGARCRM={'SINGLE_FLIGHT_TTL': 60})
+    def test_follower_executes_call_if_leader_is_interrupted(self):
+        started, release = threading.Event(), threading.Event()
+
+        def leader_func():
+            started.set()
+            release.wait()
+            raise Interrupted()
+
+        def run_leader():
+            try:
+                self.flight.do('key', leader_func)
+            except Interrupted:
+                results['leader'] = 'interrupted'
+
+        results = {}
+        leader = threading.Thread(target=run_leader)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.update(follower=self.flight.do('key', lambda: 'result')))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join(5)
+
+        self.assertFalse(follower.is_alive())
+        self.assertEqual(results, {'leader': 'interrupted', 'follower': 'result'})
+        # result of follower call is kept instead of interrupted one
+        self.assertEqual(self.flight.do('key', lambda: 'new result'), 'result')
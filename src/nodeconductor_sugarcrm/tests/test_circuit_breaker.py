@@ -0,0 +1,99 @@
+from django.core.cache import caches
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+import requests
+
+from nodeconductor_sugarcrm.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'circuit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'circuit'},
+    },
+    NODECONDUCTOR_SUGARCRM={
+        'CIRCUIT_BREAKER_FAILURE_THRESHOLD': 2,
+        'CIRCUIT_BREAKER_RESET_TIMEOUT': 60,
+        'CIRCUIT_BREAKER_CACHE': 'circuit',
+    })
+class CircuitBreakerTest(TestCase):
+    URL = 'http://crm.example.com/service/v4/rest.php'
+
+    def setUp(self):
+        caches['circuit'].clear()
+        self.breaker = CircuitBreaker()
+        self.now = 1000.0
+        time_patcher = mock.patch('nodeconductor_sugarcrm.circuit_breaker.time')
+        self.addCleanup(time_patcher.stop)
+        time_patcher.start().time.side_effect = lambda: self.now
+
+    def send_failing(self):
+        raise requests.exceptions.ConnectionError('Connection refused')
+
+    def send_succeeding(self, status_code=200):
+        return mock.Mock(status_code=status_code)
+
+    def open_circuit(self):
+        for _ in range(2):
+            self.assertRaises(requests.exceptions.ConnectionError, self.breaker.call, self.URL, self.send_failing)
+
+    def test_circuit_is_closed_until_failures_threshold(self):
+        self.assertRaises(requests.exceptions.ConnectionError, self.breaker.call, self.URL, self.send_failing)
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.CLOSED)
+
+    def test_circuit_is_opened_after_failures_threshold(self):
+        self.open_circuit()
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.OPEN)
+
+    def test_gateway_errors_are_counted_as_failures(self):
+        for _ in range(2):
+            self.breaker.call(self.URL, lambda: self.send_succeeding(status_code=503))
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.OPEN)
+
+    def test_request_is_not_sent_if_circuit_is_open(self):
+        self.open_circuit()
+        send = mock.Mock()
+
+        self.assertRaises(CircuitOpenError, self.breaker.call, self.URL, send)
+        self.assertFalse(send.called)
+
+    def test_circuit_of_other_host_is_not_affected(self):
+        self.open_circuit()
+
+        self.assertEqual(self.breaker.get_state('http://other.example.com/'), CircuitBreaker.States.CLOSED)
+
+    def test_circuit_is_half_open_after_reset_timeout(self):
+        self.open_circuit()
+        self.now += 61
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.HALF_OPEN)
+
+    def test_circuit_is_closed_if_probe_succeeds(self):
+        self.open_circuit()
+        self.now += 61
+
+        self.breaker.call(self.URL, self.send_succeeding)
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.CLOSED)
+
+    def test_circuit_is_opened_again_if_probe_fails(self):
+        self.open_circuit()
+        self.now += 61
+
+        self.assertRaises(requests.exceptions.ConnectionError, self.breaker.call, self.URL, self.send_failing)
+
+        self.assertEqual(self.breaker.get_state(self.URL), CircuitBreaker.States.OPEN)
+
+    def test_only_one_probe_is_sent_in_half_open_state(self):
+        self.open_circuit()
+        self.now += 61
+
+        def probe():
+            self.assertRaises(CircuitOpenError, self.breaker.call, self.URL, self.send_succeeding)
+            return self.send_succeeding()
+
+        self.breaker.call(self.URL, probe)
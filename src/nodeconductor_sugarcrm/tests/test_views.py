@@ -0,0 +1,92 @@
+import uuid
+
+from django.test import TestCase
+import mock
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+import sugarcrm
+
+from nodeconductor_sugarcrm import views
+
+
+class CRMUsersBulkTest(TestCase):
+    EMPTY_FIELDS = {'first_name': '', 'email1': '', 'phone_mobile': ''}
+
+    def setUp(self):
+        self.crm = mock.Mock(uuid=uuid.uuid4())
+        self.quota = self.crm.quotas.get.return_value
+        self.quota.is_exceeded.return_value = False
+        self.backend = mock.Mock()
+        self.backend.get_existing_user_names.return_value = []
+        self.backend.create_users.side_effect = lambda users_data: [
+            sugarcrm.User(**dict(self.EMPTY_FIELDS, id=str(index), **data)) for index, data in enumerate(users_data)]
+        self.backend.update_users.side_effect = lambda updates: [
+            sugarcrm.User(**dict(vars(user), **fields)) for user, fields in updates]
+        event_logger = mock.patch('nodeconductor_sugarcrm.views.event_logger')
+        self.addCleanup(event_logger.stop)
+        event_logger.start()
+
+    def bulk(self, data):
+        view = views.CRMUserViewSet()
+        view.crm = self.crm
+        view.backend = self.backend
+        view.action = 'bulk'
+        view.format_kwarg = None
+        view.request = Request(APIRequestFactory().post('/', data, format='json'), parsers=[JSONParser()])
+        return view.bulk(view.request, self.crm.uuid.hex)
+
+    def get_user(self, user_id, status='Active'):
+        return sugarcrm.User(id=user_id, user_name='user%s' % user_id, last_name='User', status=status, is_admin='0',
+                             **self.EMPTY_FIELDS)
+
+    def test_quota_is_checked_once_for_all_created_users(self):
+        response = self.bulk({'create': [{'user_name': 'alice', 'last_name': 'A'},
+                                         {'user_name': 'bob', 'last_name': 'B'}]})
+
+        self.assertEqual(response.status_code, 200)
+        self.quota.is_exceeded.assert_called_once_with(delta=2)
+        self.assertEqual(len(self.backend.create_users.call_args[0][0]), 2)
+
+    def test_users_are_not_created_if_quota_is_exceeded(self):
+        self.quota.is_exceeded.return_value = True
+
+        response = self.bulk({'create': [{'user_name': 'alice', 'last_name': 'A'},
+                                         {'user_name': 'bob', 'last_name': 'B'}]})
+
+        self.assertFalse(self.backend.create_users.called)
+        self.assertEqual([result['errors'].keys() for result in response.data],
+                         [['non_field_errors'], ['non_field_errors']])
+
+    def test_users_with_existing_and_repeated_names_are_not_counted(self):
+        self.backend.get_existing_user_names.return_value = ['alice']
+
+        response = self.bulk({'create': [{'user_name': 'alice', 'last_name': 'A'},
+                                         {'user_name': 'bob', 'last_name': 'B'},
+                                         {'user_name': 'bob', 'last_name': 'B'}]})
+
+        self.backend.get_existing_user_names.assert_called_once_with(['alice', 'bob'])
+        self.quota.is_exceeded.assert_called_once_with(delta=1)
+        self.assertEqual(sorted(result['user_name'] for result in response.data if 'errors' in result),
+                         ['alice', 'bob'])
+
+    def test_user_cannot_be_updated_and_deactivated_in_one_request(self):
+        self.backend.get_users.return_value = [self.get_user('1')]
+
+        response = self.bulk({'update': [{'uuid': '1', 'status': 'Inactive'}], 'deactivate': ['1']})
+
+        updates = self.backend.update_users.call_args[0][0]
+        self.assertEqual([(user.id, fields) for user, fields in updates], [('1', {'status': 'Inactive'})])
+        self.assertEqual(response.data[0], {
+            'action': 'deactivate', 'uuid': '1',
+            'errors': {'uuid': ['User with such uuid is already defined in request.']}})
+        self.assertEqual(response.data[1]['action'], 'update')
+
+    def test_users_are_deactivated_by_one_update(self):
+        self.backend.get_users.return_value = [self.get_user('1'), self.get_user('2', status='Inactive')]
+
+        self.bulk({'deactivate': ['1', '2']})
+
+        updates = self.backend.update_users.call_args[0][0]
+        self.assertEqual([(user.id, fields) for user, fields in updates],
+                         [('1', {'status': 'Inactive'}), ('2', {'status': 'Inactive'})])
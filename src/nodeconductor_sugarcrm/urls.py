@@ -6,3 +6,5 @@ def register_in(router):
     router.register(r'sugarcrm-crms', views.CRMViewSet, base_name='sugarcrm-crms')
     router.register(r'sugarcrm-service-project-link', views.SugarCRMServiceProjectLinkViewSet, base_name='sugarcrm-spl')
     router.register(r'sugarcrm-crms/(?P<crm_uuid>[\w]+)/users', views.CRMUserViewSet, base_name='sugarcrm-users')
+    router.register(r'sugarcrm-instance-events', views.CRMInstanceEventsViewSet, base_name='sugarcrm-instance-events')
+    router.register(r'sugarcrm-metrics', views.BackendMetricsViewSet, base_name='sugarcrm-metrics')
@@ -1,15 +1,63 @@
+import collections
 import logging
+import re
 
+from django.conf import settings
 from django.core.mail import send_mail
 
 
 logger = logging.getLogger(__name__)
 
 
+class SettingsOptions(object):
+    """ Immutable snapshot of service settings options with backend defaults and precompiled phone regex """
+
+    def __init__(self, service_settings, version):
+        options = dict(service_settings.get_backend().DEFAULTS)
+        options.update(service_settings.options or {})
+        self._options = options
+        self.version = version
+        phone_regex = options.get('phone_regex')
+        self.phone_regex = re.compile(phone_regex) if phone_regex else None
+
+    def __getitem__(self, name):
+        return self._options.get(name)
+
+    def get(self, name, default=None):
+        return self._options.get(name, default)
+
+
+# versions of service settings options, are increased on service settings change
+_options_versions = collections.defaultdict(int)
+
+
+def get_options(service_settings):
+    """ Get options snapshot of service settings.
+
+    Snapshot is memoized on service settings object, so options are built once per request or task.
+    It is rebuilt if service settings were changed after snapshot creation.
+    """
+    version = _options_versions[service_settings.pk]
+    snapshot = getattr(service_settings, '_sugarcrm_options', None)
+    if snapshot is None or snapshot.version != version:
+        snapshot = SettingsOptions(service_settings, version)
+        service_settings._sugarcrm_options = snapshot
+    return snapshot
+
+
+def get_crm_options(crm):
+    return get_options(crm.service_project_link.service.settings)
+
+
+def invalidate_options(service_settings):
+    _options_versions[service_settings.pk] += 1
+    service_settings.__dict__.pop('_sugarcrm_options', None)
+
+
 def sms_user_password(crm, phone, password):
-    settings = crm.service_project_link.service.settings
-    sender = settings.get_option('sms_email_from')
-    recipient = settings.get_option('sms_email_rcpt')
+    options = get_crm_options(crm)
+    sender = options['sms_email_from']
+    recipient = options['sms_email_rcpt']
 
     if sender and recipient and '{phone}' in recipient:
         send_mail(
@@ -18,3 +66,8 @@ def sms_user_password(crm, phone, password):
     else:
         logger.warning('SMS was not sent to SugarCRM user, because `sms_email_from` and `sms_email_rcpt` '
                        'were not configured properly.')
+
+
+def get_plugin_setting(name, default=None):
+    """ Get value from NODECONDUCTOR_SUGARCRM dictionary of Django settings """
+    return getattr(settings, 'NODECONDUCTOR_SUGARCRM', {}).get(name, default)
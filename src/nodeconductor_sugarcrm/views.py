@@ -1,14 +1,22 @@
 import copy
+import hashlib
+import json
+import re
 
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.utils.crypto import get_random_string
-from rest_framework import status, viewsets, exceptions
-from rest_framework.decorators import detail_route
+from django.utils import six
+from django.utils.crypto import constant_time_compare, get_random_string
+from rest_framework import status, viewsets, exceptions, permissions
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
 
+from nodeconductor.core.tasks import send_task
 from nodeconductor.structure import views as structure_views
 from nodeconductor.structure.managers import filter_queryset_for_user
-from . import models, serializers, backend, signals, utils, log
+from . import models, serializers, backend, signals, utils, log, metrics
 
 event_logger = log.event_logger
 
@@ -33,11 +41,58 @@ class CRMViewSet(structure_views.BaseOnlineResourceViewSet):
         backend.provision(resource, user_count=serializer.validated_data['user_count'])
 
 
+class CRMInstanceEventsViewSet(viewsets.ViewSet):
+    """ Receiver of NodeConductor web hooks with events of CRMs OpenStack instances.
+
+    Continues CRM provisioning or deletion as soon as its instance is created or stopped.
+    """
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+    supported_event_types = (
+        'resource_creation_succeeded',
+        'resource_creation_failed',
+        'resource_stop_succeeded',
+        'resource_stop_failed',
+    )
+    uuid_regex = re.compile(r'^[0-9a-fA-F]{32}$')
+
+    def create(self, request):
+        token = utils.get_plugin_setting('INSTANCE_EVENTS_TOKEN')
+        if not token or not constant_time_compare(request.query_params.get('token', ''), token):
+            raise exceptions.PermissionDenied()
+
+        data = request.data if isinstance(request.data, dict) else {}
+        context = data.get('context')
+        instance_uuid = context.get('resource_uuid') if isinstance(context, dict) else None
+        if (data.get('type') in self.supported_event_types and isinstance(instance_uuid, six.string_types) and
+                self.uuid_regex.match(instance_uuid)):
+            # UUID is matched with whole segment of instance URL
+            crms = models.CRM.objects.filter(
+                instance_url__contains='/%s/' % instance_uuid.lower(),
+                state__in=[models.CRM.States.PROVISIONING, models.CRM.States.STOPPING])
+            for crm in crms:
+                send_task('sugarcrm', 'continue_crm_operation')(crm.uuid.hex)
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class BackendMetricsViewSet(viewsets.ViewSet):
+    """ Metrics of backend requests of API process in Prometheus text format. Available only for staff """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def list(self, request):
+        return HttpResponse(metrics.registry.export(), content_type='text/plain; version=0.0.4')
+
+
 class CRMNotOnline(exceptions.APIException):
     status_code = 409
 
 
+class CRMUnavailable(exceptions.APIException):
+    status_code = 503
+
+
 class CRMUserViewSet(viewsets.ViewSet):
+    pagination_class = api_settings.DEFAULT_PAGINATION_CLASS
 
     def initial(self, request, crm_uuid, *args, **kwargs):
         super(CRMUserViewSet, self).initial(request, crm_uuid, *args, **kwargs)
@@ -48,6 +103,10 @@ class CRMUserViewSet(viewsets.ViewSet):
         self.backend = self.crm.get_backend()
 
     def handle_exception(self, exc):
+        # CRM host is considered unreachable by circuit breaker, CRM is recovered by circuit probe
+        if isinstance(exc, backend.SugarCRMUnavailableError):
+            return super(CRMUserViewSet, self).handle_exception(
+                CRMUnavailable('CRM API is temporarily unavailable.'))
         if isinstance(exc, backend.SugarCRMBackendError):
             self.crm.set_erred()
             self.crm.error_message = str(exc)
@@ -57,25 +116,112 @@ class CRMUserViewSet(viewsets.ViewSet):
         return super(CRMUserViewSet, self).handle_exception(exc)
 
     def get_serializer_context(self):
-        return {'crm': self.crm, 'request': self.request, 'view': self}
+        context = {'crm': self.crm, 'request': self.request, 'view': self}
+        if self.action in ('list', 'retrieve'):
+            context['fields'] = self.get_requested_fields(self.request)
+        return context
+
+    def is_query_param_enabled(self, request, name):
+        return request.query_params.get(name) in ('1', 'true', 'True')
+
+    def is_fresh_data_requested(self, request):
+        """ Users are read from SugarCRM directly instead of local copies if ?fresh=1 is specified.
+
+        Local copies are seeded by periodic pull task, so users of CRM that was not pulled yet
+        are read from SugarCRM too.
+        """
+        return self.is_query_param_enabled(request, 'fresh') or self.crm.users_synced_at is None
+
+    def get_requested_fields(self, request):
+        """ Only given fields are rendered if ?fields=a,b,c is specified """
+        return [field for field in request.query_params.get('fields', '').split(',') if field]
+
+    def get_source_fields(self, request, *extra_fields):
+        """ Get SugarCRM users fields that should be requested to render requested fields.
+
+        Empty tuple means that all fields are requested.
+        """
+        fields = serializers.CRMUserSerializer.get_source_fields(self.get_requested_fields(request))
+        if not fields:
+            return ()
+        # admin flag and status are needed to hide admin and reserved users
+        return tuple(sorted(set(fields) | {'is_admin', 'status'} | set(extra_fields)))
+
+    def get_filter_kwargs(self, request):
+        serializer = serializers.CRMUsersFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return dict(serializer.validated_data)
 
-    # XXX: This method should be replaced by default filter then CRM users will be moved to separate model
     def get_filtered_users(self, request):
-        supported_filters = ['first_name', 'last_name', 'user_name', 'status']
-        filter_kwargs = {f: request.query_params[f] for f in supported_filters if f in request.query_params}
-        return self.backend.list_users(**filter_kwargs)
+        filter_kwargs = self.get_filter_kwargs(request)
+        # ?uuid=a,b,c filters users by several ids
+        user_ids = [user_id for user_id in request.query_params.get('uuid', '').split(',') if user_id]
+        if self.is_fresh_data_requested(request):
+            fields = self.get_source_fields(request, *filter_kwargs)
+            if user_ids:
+                return self.get_users_by_ids(user_ids, fields=fields, **filter_kwargs)
+            return self.backend.get_users_list(fields=fields, **filter_kwargs)
+        users = self.crm.users.filter(**filter_kwargs)
+        if user_ids:
+            users = users.filter(backend_id__in=user_ids)
+        return users.order_by('user_name')
+
+    def get_users_by_ids(self, user_ids, fields=(), **filter_kwargs):
+        """ Get visible users with given ids from SugarCRM with few requests and filter them """
+        reserved_status = backend.SugarCRMBackend.SugarCRMClient.UserStatuses.RESERVED
+        users = self.backend.get_users(user_ids, fields=fields)
+        return [user for user in users
+                if not int(user.is_admin) and user.status != reserved_status and
+                all(getattr(user, field, None) == value for field, value in filter_kwargs.items())]
 
     def list(self, request, crm_uuid):
+        """ Users list is paginated. Users are streamed page by page in one response if ?stream=1 is specified """
         users = self.get_filtered_users(request)
-        serializer = serializers.CRMUserSerializer(users, many=True, context=self.get_serializer_context())
-        return Response(serializer.data)
+        if self.is_query_param_enabled(request, 'stream'):
+            return self.get_streaming_response(users)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(users, request, view=self)
+        serializer = serializers.CRMUserSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    def get_streaming_response(self, users):
+        context = self.get_serializer_context()
+        page_size = int(utils.get_crm_options(self.crm)['users_page_size'])
+
+        def stream():
+            yield '['
+            is_first = True
+            users_count = len(users) if isinstance(users, list) else users.count()
+            for offset in range(0, users_count, page_size):
+                for user in users[offset:offset + page_size]:
+                    data = serializers.CRMUserSerializer(user, context=context).data
+                    yield ('' if is_first else ',') + json.dumps(data, cls=encoders.JSONEncoder)
+                    is_first = False
+            yield ']'
+
+        return StreamingHttpResponse(stream(), content_type='application/json')
 
     def retrieve(self, request, crm_uuid, pk=None):
-        user = self.backend.get_user(pk)
-        if user is None or int(user.is_admin):
-            return Response(status=status.HTTP_404_NOT_FOUND)
+        if self.is_fresh_data_requested(request):
+            user = self.backend.get_user(pk, fields=self.get_source_fields(request))
+            if user is None or int(user.is_admin):
+                return Response(status=status.HTTP_404_NOT_FOUND)
+        else:
+            user = get_object_or_404(self.crm.users.all(), backend_id=pk)
         serializer = serializers.CRMUserSerializer(user, context=self.get_serializer_context())
-        return Response(serializer.data)
+        return self.get_conditional_response(request, serializer.data)
+
+    def get_conditional_response(self, request, data):
+        """ Return response with ETag of data, response is empty if data was not changed since If-None-Match """
+        etag = '"%s"' % hashlib.md5(json.dumps(data, cls=encoders.JSONEncoder, sort_keys=True)).hexdigest()
+        client_etags = [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+        if etag in client_etags or '*' in client_etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
 
     def destroy(self, request, crm_uuid, pk=None):
         user = self.backend.get_user(pk)
@@ -119,9 +265,115 @@ class CRMUserViewSet(viewsets.ViewSet):
             sender=models.CRM, old_user=old_user, new_user=new_user, crm=self.crm, created=False)
         return Response(user_data, status.HTTP_200_OK)
 
+    @list_route(methods=['post'])
+    def bulk(self, request, crm_uuid):
+        """ Create, update and deactivate several users with one request.
+
+        User count quota is checked once for all created users.
+        Response contains result of each operation.
+        """
+        bulk_serializer = serializers.CRMUsersBulkSerializer(data=request.data)
+        bulk_serializer.is_valid(raise_exception=True)
+        context = dict(self.get_serializer_context(), bulk=True)
+        results = []
+
+        # creation
+        users_to_create = []
+        for data in bulk_serializer.validated_data.get('create', []):
+            serializer = serializers.CRMUserSerializer(data=data, context=context)
+            if not serializer.is_valid():
+                results.append({'action': 'create', 'user_name': data.get('user_name'), 'errors': serializer.errors})
+            elif serializer.validated_data['user_name'] in [u['user_name'] for u in users_to_create]:
+                results.append({'action': 'create', 'user_name': data.get('user_name'),
+                                'errors': {'user_name': ['User with such name is already defined in request.']}})
+            else:
+                users_to_create.append(serializer.validated_data)
+
+        # names are checked with one local query and one request to SugarCRM
+        if users_to_create:
+            existing_names = self.backend.get_existing_user_names([data['user_name'] for data in users_to_create])
+            for data in users_to_create:
+                if data['user_name'] in existing_names:
+                    results.append({'action': 'create', 'user_name': data['user_name'],
+                                    'errors': {'user_name': ['User with such name already exists.']}})
+            users_to_create = [data for data in users_to_create if data['user_name'] not in existing_names]
+
+        created_users = []
+        if users_to_create:
+            user_count_quota = self.crm.quotas.get(name=self.crm.Quotas.user_count)
+            if user_count_quota.is_exceeded(delta=len(users_to_create)):
+                message = ('User count quota is over limit (users count: %s, max users count: %s, requested: %s).' %
+                           (user_count_quota.usage, user_count_quota.limit, len(users_to_create)))
+                for data in users_to_create:
+                    results.append({'action': 'create', 'user_name': data['user_name'],
+                                    'errors': {'non_field_errors': [message]}})
+            else:
+                notifications = [data.pop('notify', False) for data in users_to_create]
+                passwords = [get_random_string(10) for _ in users_to_create]
+                created_users = self.backend.create_users(
+                    [dict({'status': 'Active'}, password=password, **data)
+                     for password, data in zip(passwords, users_to_create)])
+                for user, password, notify in zip(created_users, passwords, notifications):
+                    if notify:
+                        utils.sms_user_password(self.crm, user.phone_mobile, password)
+                    user_data = serializers.CRMUserSerializer(user, context=context).data
+                    results.append({'action': 'create', 'user_name': user.user_name,
+                                    'user': dict(password=password, **user_data)})
+
+        # update and deactivation
+        updates = [('update', dict(data)) for data in bulk_serializer.validated_data.get('update', [])]
+        updates += [('deactivate', {'uuid': user_id, 'status': 'Inactive'})
+                    for user_id in bulk_serializer.validated_data.get('deactivate', [])]
+        user_ids = [data['uuid'] for _, data in updates if data.get('uuid')]
+        # users are read from SugarCRM, so quota is changed according to their actual statuses
+        old_users = {user.id: user for user in self.get_users_by_ids(user_ids)} if user_ids else {}
+
+        users_to_update = []
+        actions = []
+        changed_user_ids = set()
+        for action, data in updates:
+            user_id = data.pop('uuid', None)
+            old_user = old_users.get(user_id)
+            if old_user is None:
+                results.append({'action': action, 'uuid': user_id, 'errors': {'uuid': ['User does not exist.']}})
+                continue
+            # quota change is calculated from old user status, so each user can be changed only once
+            if user_id in changed_user_ids:
+                results.append({'action': action, 'uuid': user_id,
+                                'errors': {'uuid': ['User with such uuid is already defined in request.']}})
+                continue
+            changed_user_ids.add(user_id)
+            serializer = serializers.CRMUserSerializer(instance=old_user, data=data, context=context)
+            if not serializer.is_valid():
+                results.append({'action': action, 'uuid': user_id, 'errors': serializer.errors})
+                continue
+            users_to_update.append((old_user, serializer.validated_data))
+            actions.append(action)
+
+        updated_users = self.backend.update_users(users_to_update) if users_to_update else []
+        for user, action in zip(updated_users, actions):
+            user_data = serializers.CRMUserSerializer(user, context=context).data
+            results.append({'action': action, 'uuid': user.id, 'user': user_data})
+
+        if created_users or updated_users:
+            event_logger.sugarcrm_users_bulk.info(
+                '{created_count} users have been created, {updated_count} users have been updated '
+                '(including {deactivated_count} deactivated) in CRM {crm_name} by bulk operation.',
+                event_type='sugarcrm_users_bulk_operation_succeeded',
+                event_context={
+                    'crm': self.crm,
+                    'created_count': len(created_users),
+                    'updated_count': len(updated_users),
+                    'deactivated_count': actions.count('deactivate'),
+                })
+
+        return Response(results, status=status.HTTP_200_OK)
+
     @detail_route(methods=['post'])
     def password(self, request, crm_uuid, pk=None):
         user = self.backend.get_user(pk)
+        if user is None or int(user.is_admin):
+            return Response(status=status.HTTP_404_NOT_FOUND)
         serializer = serializers.UserPasswordSerializer(data=request.data, context={'user': user})
         serializer.is_valid(raise_exception=True)
 